@@ -10,10 +10,16 @@ gi.require_version("Gtk", "3.0")
 gi.require_version("PangoCairo", "1.0")
 gi.require_version("Vte", "2.91")
 
-import os, sys
+import os, sys, json
 from gi.repository import GObject, GLib, Gio, Gtk, Gdk
 
 from b8 import logs, configs, vim, files, buffers, service, terminals, version
+from b8 import finder, grep, symbols, sessions, scrollback
+
+
+# Give NeoVim this long to tell us about its buffers when quitting, in
+# milliseconds, before quitting without saving the session.
+QUIT_TIMEOUT = 1000
 
 
 class B8Window(Gtk.Window, logs.LoggerMixin):
@@ -32,7 +38,12 @@ class B8Window(Gtk.Window, logs.LoggerMixin):
     self.rsplit = rsplit
 
     lsplit.pack1(self.b8.buffers, resize=True, shrink=False)
-    lsplit.pack2(self.b8.files, resize=True, shrink=False)
+    self.lbook = Gtk.Notebook()
+    self.lbook.append_page(self.b8.files, Gtk.Label(label='Files'))
+    self.lbook.append_page(self.b8.grep, Gtk.Label(label='Search'))
+    self.lbook.append_page(self.b8.scrollback,
+        Gtk.Label(label='Terminals'))
+    lsplit.pack2(self.lbook, resize=True, shrink=False)
     hsplit.pack1(lsplit, resize=True, shrink=False)
     hsplit.pack2(rsplit, resize=True, shrink=False)
     hsplit.set_property('position', 250)
@@ -55,18 +66,34 @@ class B8(GObject.GObject, logs.LoggerMixin):
     GObject.GObject.__init__(self)
     logs.LoggerMixin.__init__(self)
     self.config = configs.Config()
+    self.sessions = sessions.Sessions(self.config.session_file.get_path())
+    self.session = None
+    self.quitting = None
 
     self.service = service.Service(self)
     self._add_actions()
     self.vim = vim.Embedded()
+    self.vim.record_path = self.config.get(('vim', 'record'))
+    self.vim.latency_report = self.config.get(('vim', 'latency-report'))
     self.vim.connect('ready', self._on_vim_ready)
     self.vim.connect('exited', self._on_vim_exited)
+    self.vim.connect('leaving', self._on_vim_leaving)
     self.buffers = buffers.Buffers()
     self.files = files.Files()
+    self.finder = finder.Finder()
+    self.finder.connect('file-activated', self._on_file_activated)
+    self.symbols = symbols.Symbols()
+    self.symbols.connect('location-activated', self._on_location_activated)
+    self.grep = grep.Grep()
+    self.grep.connect('location-activated', self._on_location_activated)
+    self.files.connect('directory-changed', self._on_directory_changed)
     self.terminals = terminals.Terminals(
         font=self.config.get(('terminal', 'font')),
         theme=self.config.get(('terminal', 'theme')),
+        scrollback_lines=self.config.get_int(('terminal', 'scrollback')),
     )
+    self.scrollback = scrollback.ScrollbackSearch(self.terminals.index)
+    self.scrollback.connect('line-activated', self._on_line_activated)
 
     for w in [self.buffers, self.files, self.terminals]:
       w.connect('directory-activated', self._on_directory_activated)
@@ -76,13 +103,18 @@ class B8(GObject.GObject, logs.LoggerMixin):
 
     self.vim.connect('buffer-changed', self._on_buffer_changed)
     self.vim.connect('buffer-deleted', self._on_buffer_deleted)
+    self.vim.connect('buffers-added', self._on_buffers_added)
+    self.vim.connect('buffers-info', self._on_buffers_info)
     self.buffers.connect('buffer-activated', self._on_buffer_activated)
 
   def browse(self, f):
     self.files.browse(f)
 
-  def open_buffer(self, f):
-    self.vim.open_buffer(f.get_path())
+  def open_buffer(self, f, line=None):
+    self.vim.open_buffer(f.get_path(), line)
+
+  def open_buffers(self, paths, lines=None, current=0):
+    self.vim.open_buffers(paths, lines, current)
 
   def _on_directory_activated(self, w, f):
     self.browse(f)
@@ -90,6 +122,15 @@ class B8(GObject.GObject, logs.LoggerMixin):
   def _on_file_activated(self, w, f):
     self.open_buffer(f)
 
+  def _on_location_activated(self, w, f, line):
+    self.open_buffer(f, line)
+
+  def _on_line_activated(self, w, t, row):
+    self.terminals.show_row(t, row)
+
+  def _on_directory_changed(self, w, f):
+    self.grep.directory = f
+
   def _on_buffer_changed(self, w, bnum, f):
     self.buffers.change(f, bnum)
     self.window.set_title(f.get_path())
@@ -97,6 +138,12 @@ class B8(GObject.GObject, logs.LoggerMixin):
   def _on_buffer_deleted(self, w, bnum, f):
     self.buffers.remove(f, bnum)
 
+  def _on_buffers_added(self, w, buffers):
+    self.buffers.add_all(buffers)
+
+  def _on_buffers_info(self, w, info):
+    self.buffers.update_info(info)
+
   def _on_file_destroyed(self, w, f):
     self.vim.close_buffer(f.get_path())
 
@@ -115,6 +162,10 @@ class B8(GObject.GObject, logs.LoggerMixin):
         'previous-terminal': self._on_prevterminal_activate,
         'new-terminal': self._on_newterminal_activate,
         'close-all': self._on_closeall_activate,
+        'quick-open': self._on_quickopen_activate,
+        'search': self._on_search_activate,
+        'symbols': self._on_symbols_activate,
+        'terminal-search': self._on_terminalsearch_activate,
     }
     for act in config_map:
       accel = self.config.get(('shortcuts', act))
@@ -139,6 +190,31 @@ class B8(GObject.GObject, logs.LoggerMixin):
   def _on_closeall_activate(self):
     self.buffers.remove_all()
 
+  def _on_quickopen_activate(self):
+    d = self.files.directory
+    if not d:
+      return
+    r = self.files.repository
+    self.finder.show_for(r.root if r else d.get_path(), r)
+
+  def _on_symbols_activate(self):
+    d = self.files.directory
+    if not d:
+      return
+    r = self.files.repository
+    self.symbols.show_for(
+        self.finder.get_index(r.root if r else d.get_path(), r))
+
+  def _on_search_activate(self):
+    book = self.window.lbook
+    book.set_current_page(book.page_num(self.grep))
+    self.grep.focus()
+
+  def _on_terminalsearch_activate(self):
+    book = self.window.lbook
+    book.set_current_page(book.page_num(self.scrollback))
+    self.scrollback.focus()
+
   def _on_key_press_event(self, w, event):
     kn = Gdk.keyval_name(event.keyval)
     if kn in vim.MODIFIER_NAMES:
@@ -156,9 +232,25 @@ class B8(GObject.GObject, logs.LoggerMixin):
     self.window.show_all()
     self.vim.grab_focus()
     self.window.present()
-    for path in self.config.files:
-      f = Gio.File.new_for_path(path)
-      self.open_buffer(f)
+    paths, lines, current = [], [], 0
+    if self.session:
+      for path, line in self.session.existing_buffers():
+        if path == self.session.current_buffer:
+          current = len(paths)
+        paths.append(path)
+        lines.append(line)
+    if self.config.files:
+      current = len(paths)
+      paths += self.config.files
+      lines += [None] * len(self.config.files)
+    self.open_buffers(paths, lines, current)
+
+  def _on_vim_leaving(self, w, info):
+    # Quit from inside NeoVim, like with :qa, rather than by closing b8.
+    if self.quitting is not None:
+      return
+    if self.config.get(('session', 'restore')) == 'yes':
+      self.save_session(info)
 
   def _on_vim_exited(self, w):
     self.debug('goodbye, b8 ♡ u')
@@ -172,6 +264,7 @@ class B8(GObject.GObject, logs.LoggerMixin):
     cmdmap = {
         'ping': self._on_service_ping,
         'open': self._on_service_open,
+        'stats': self._on_service_stats,
     }
     f = cmdmap.get(cmd, self._on_service_unsupported)
     return f(*args)
@@ -181,25 +274,53 @@ class B8(GObject.GObject, logs.LoggerMixin):
 
   def _on_service_open(self, *files):
     self.debug(f'remote open {files}')
-    for path in files:
-      f = Gio.File.new_for_path(path)
-      self.open_buffer(f)
+    self.open_buffers(files)
     return ['ok']
 
+  def _on_service_watch(self, conn):
+    self.debug('remote viewer watching')
+    self.vim.publisher.add(conn)
+
+  def _on_service_stats(self):
+    return ['ok', self.stats()]
+
   def _on_service_unsupported(self, *args):
     return ['unknown', args]
 
+  def stats(self):
+    """Runtime statistics, for finding out where time goes."""
+    return {
+        'vim': {
+            'latency': self.vim.latency.summary(),
+            'redraw': self.vim.redraw_stats.summary(),
+            'flush_sizes': self.vim.flush_sizes.summary(),
+        },
+        'terminals': self.terminals.stats(),
+    }
+
   def run(self):
-    if self.config.remote:
+    if self.config.remote or self.config.stats:
       return
     self.debug('activating')
     self.window = B8Window(self)
+    self.finder.set_transient_for(self.window)
+    self.symbols.set_transient_for(self.window)
     self.window.connect('key-press-event', self._on_key_press_event)
     self._add_actions()
     self.service.start()
     self.vim.start()
-    self.terminals.create(os.path.expanduser('~'))
-    self.files.browse_path(os.path.expanduser('~'))
+    home = os.path.expanduser('~')
+    if self.config.get(('session', 'restore')) == 'yes':
+      self.session = self.sessions.load()
+    s = self.session
+    if s and s.terminals:
+      self.terminals.restore(s.terminals, s.current_terminal)
+    else:
+      self.terminals.create(home)
+    if s and s.directory and os.path.isdir(s.directory):
+      self.files.browse_path(s.directory)
+    else:
+      self.files.browse_path(home)
     Gtk.main()
 
   def run_remote(self):
@@ -210,9 +331,72 @@ class B8(GObject.GObject, logs.LoggerMixin):
     self.error('no instances to connect to')
     return
 
+  def run_stats(self):
+    run = service.Runtime()
+    for c in run.available():
+      resp = c.stats()
+      print(json.dumps({c.gfile.get_path(): resp[1]}, indent=2))
+
   def quit(self):
+    if self.quitting is not None:
+      return
+    if self.config.get(('session', 'restore')) != 'yes':
+      self._finish_quit()
+      return
+    # One request for every listed buffer and the line the cursor was on.
+    r = self.vim.command('nvim_eval', vim.VIM_SESSION_EXPR)
+    r.connect('success', self._on_quit_buffers)
+    r.connect('error', self._on_quit_error)
+    self.quitting = GLib.timeout_add(QUIT_TIMEOUT, self._on_quit_timeout)
+
+  def save_session(self, info: dict):
+    """Save the session, with the buffers from `vim.VIM_SESSION_EXPR`."""
+    cwds, current = self.terminals.session()
+    current_buffer = None
+    buffers = []
+    for b in info['buffers']:
+      if not b['name']:
+        continue
+      buffers.append((b['name'], b.get('lnum') or None))
+      if b['bufnr'] == info['current']:
+        current_buffer = b['name']
+    d = self.files.directory
+    self.sessions.save(sessions.Session(
+        buffers=buffers,
+        current_buffer=current_buffer,
+        directory=d.get_path() if d else None,
+        terminals=cwds,
+        current_terminal=current,
+    ))
+
+  def _on_quit_buffers(self, r, info):
+    if self.quitting is False:
+      # Too late, we gave up waiting.
+      return
+    self.save_session(info)
+    self._finish_quit()
+
+  def _on_quit_error(self, r, error):
+    if self.quitting is False:
+      return
+    self.error(f'unable to save the session: {error}')
+    self._finish_quit()
+
+  def _on_quit_timeout(self):
+    self.error('NeoVim did not answer, quitting without saving the session')
+    self.quitting = None
+    self._finish_quit()
+    return False
+
+  def _finish_quit(self):
+    if self.quitting is False:
+      return
+    if self.quitting:
+      GLib.source_remove(self.quitting)
+    self.quitting = False
     self.service.shutdown()
     self.terminals.shutdown()
+    self.symbols.shutdown()
     self.vim.quit()
 
 
@@ -221,7 +405,9 @@ def main():
   if app.config.version:
     app.info(f' Bominade, version {version.VERSION}')
     return
-  if app.config.remote:
+  if app.config.stats:
+    app.run_stats()
+  elif app.config.remote:
     app.run_remote()
   else:
     app.run()
@@ -6,13 +6,17 @@
 """The Bominade file browser."""
 
 
-import os
+import collections, os
 
 from gi.repository import Gio, GLib, GObject, Gdk, Gtk, GdkPixbuf, Pango
 
 from b8 import ui, vim, logs
 
 
+# Cycling through buffers only counts as using the one landed on after this
+# many milliseconds without another switch.
+SETTLE_DELAY = 1000
+
 
 class Buffers(Gtk.ScrolledWindow, ui.MenuHandlerMixin, logs.LoggerMixin):
 
@@ -33,6 +37,15 @@ class Buffers(Gtk.ScrolledWindow, ui.MenuHandlerMixin, logs.LoggerMixin):
     self.model = self._create_model()
     self.tree = self._create_tree(self.model)
     self.add(self.tree)
+    # Rows by buffer number, and buffer numbers by real path.
+    self.rows = {}
+    self.numbers = {}
+    # Buffer numbers, most recently used last.
+    self.mru = collections.OrderedDict()
+    # While cycling, the MRU order we are walking and where we are in it.
+    self.cycle = None
+    self.cycle_position = 0
+    self.settle_timeout = None
 
   def _create_model(self):
     m = Gtk.ListStore(object, str)
@@ -52,26 +65,40 @@ class Buffers(Gtk.ScrolledWindow, ui.MenuHandlerMixin, logs.LoggerMixin):
     return t
 
   def next(self):
-    l = self.model.iter_n_children(None)
-    if not l:
-      return
-    m, siter = self.tree.get_selection().get_selected()
-    giter = self.model.iter_next(siter)
-    if not giter:
-      # We are at the end or there is only 1, doesn't matter
-      giter = self.model.iter_nth_child(None, 0)
-    self.activate_iter(giter)
+    """Switch to the buffer used before the current one."""
+    self.step(1)
 
   def prev(self):
-    l = self.model.iter_n_children(None)
-    if not l:
+    """Switch back towards the most recently used buffer."""
+    self.step(-1)
+
+  def step(self, direction: int):
+    """Move through the buffers in most recently used order.
+
+    Repeated steps walk the order as it was when we started, which is only
+    updated once we have stayed on a buffer for a moment.
+    """
+    if not self.mru:
       return
-    m, siter = self.tree.get_selection().get_selected()
-    giter = self.model.iter_previous(siter)
-    if not giter:
-      # We are at the beginning or there is only 1, doesn't matter
-      giter = self.model.iter_nth_child(None, l - 1)
-    self.activate_iter(giter)
+    if self.cycle is None:
+      self.cycle = list(reversed(self.mru))
+      self.cycle_position = 0
+    self.cycle_position = (self.cycle_position + direction) % len(self.cycle)
+    if self.settle_timeout is not None:
+      GLib.source_remove(self.settle_timeout)
+    self.settle_timeout = GLib.timeout_add(SETTLE_DELAY,
+        self._on_settle_timeout)
+    giter = self.rows.get(self.cycle[self.cycle_position])
+    if giter:
+      self.activate_iter(giter)
+
+  def _on_settle_timeout(self):
+    self.settle_timeout = None
+    self.cycle = None
+    m, giter = self.tree.get_selection().get_selected()
+    if giter:
+      self.mru.move_to_end(self.model.get_value(giter, 0).number)
+    return False
 
   def activate_iter(self, giter):
     b = self.model.get_value(giter, 0)
@@ -87,23 +114,63 @@ class Buffers(Gtk.ScrolledWindow, ui.MenuHandlerMixin, logs.LoggerMixin):
 
   def change(self, f, number):
     self.debug(f'buffer change {f.get_path()} {number}')
-    for grow in self.model:
-      b = self.model.get_value(grow.iter, 0)
+    giter = self.rows.get(number)
+    if giter and self.model.get_value(giter, 0).path != f.get_path():
+      # The buffer has been given another name.
+      self.remove_number(number)
+      giter = None
+    if giter is None:
+      giter = self.add(number, f)
+    self.select(giter)
+    if self.cycle is None:
+      self.mru.move_to_end(number)
 
-      if b.number == number and b.path == f.get_path():
-        self.debug(f'existing {b}')
-        self.select(grow.iter)
-        return
+  def add(self, number, f) -> Gtk.TreeIter:
     b = vim.Buffer(number, f)
-    giter = self.model.append([b, b.markup])
-    self.select(giter)
+    giter = self.rows[number] = self.model.insert_with_valuesv(-1, [0, 1],
+        [b, b.markup])
+    self.numbers[os.path.realpath(b.path)] = number
+    self.mru[number] = None
+    self.mru.move_to_end(number, last=False)
+    return giter
+
+  def update_info(self, info: dict):
+    """Show the details from `Embedded`'s `buffers-info`."""
+    for number, (modified, lines, filetype) in info.items():
+      giter = self.rows.get(number)
+      if giter:
+        b = self.model.get_value(giter, 0)
+        b.set_info(modified, lines, filetype)
+        self.model.set(giter, [1], [b.markup])
+
+  def add_all(self, buffers):
+    """Add many `(number, Gio.File)` buffers at once.
+
+    The model is detached while it is filled so the view only updates once.
+    """
+    self.tree.set_model(None)
+    for number, f in buffers:
+      if number not in self.rows:
+        self.add(number, f)
+    self.tree.set_model(self.model)
 
   def remove(self, f, number):
-    for grow in self.model:
-      b = self.model.get_value(grow.iter, 0)
-      if b.number == number and b.path == os.path.realpath(f.get_path()):
-        self.model.remove(grow.iter)
-        return
+    giter = self.rows.get(number)
+    if giter and self.numbers.get(os.path.realpath(f.get_path())) == number:
+      self.remove_number(number)
+
+  def remove_number(self, number):
+    giter = self.rows.pop(number)
+    b = self.model.get_value(giter, 0)
+    self.numbers.pop(os.path.realpath(b.path), None)
+    self.mru.pop(number, None)
+    if self.cycle and number in self.cycle:
+      self.cycle.remove(number)
+      if self.cycle:
+        self.cycle_position %= len(self.cycle)
+      else:
+        self.cycle = None
+    self.model.remove(giter)
 
   def remove_all(self):
     for grow in self.model:
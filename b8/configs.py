@@ -114,10 +114,18 @@ class Config(GObject.GObject, logs.LoggerMixin):
   items = [
       Item('logging', 'level', 'info',
         'logging level to use'),
+      Item('vim', 'record', '',
+        'record the NeoVim RPC stream to this file, see b8.recordings'),
+      Item('vim', 'latency-report', '',
+        'write keypress latency percentiles to this JSON file on exit'),
+      Item('session', 'restore', 'yes',
+        'save the session on quit and restore it on start, yes or no'),
       Item('terminal', 'theme', 'b8',
         'terminal theme to use'),
       Item('terminal', 'font', 'Monospace 13',
         'the terminal font to use, e.g. "Monospace 13"'),
+      Item('terminal', 'scrollback', '200000',
+        'lines of scrollback shared by all terminals, -1 for no limit'),
       Item('shortcuts', 'previous-buffer', '<Alt>Up',
         'shortcut key to switch to the previous buffer'),
       Item('shortcuts', 'next-buffer', '<Alt>Down',
@@ -130,6 +138,14 @@ class Config(GObject.GObject, logs.LoggerMixin):
         'shortcut key to create a new terminal'),
       Item('shortcuts', 'close-all', '<Alt>c', 
         'shortcut key to close all buffers'),
+      Item('shortcuts', 'quick-open', '<Alt>o',
+        'shortcut key to find and open a file in the project'),
+      Item('shortcuts', 'search', '<Alt>g',
+        'shortcut key to search the contents of files in the project'),
+      Item('shortcuts', 'symbols', '<Alt>s',
+        'shortcut key to jump to a function or class in the project'),
+      Item('shortcuts', 'terminal-search', '<Alt>r',
+        'shortcut key to search the output of every terminal'),
   ]
 
   def __init__(self):
@@ -184,6 +200,8 @@ class Config(GObject.GObject, logs.LoggerMixin):
         default=self.file.get_path())
     p.add_argument('-r', '--remote', action='store_true',
         help='run a remote command')
+    p.add_argument('-s', '--stats', action='store_true',
+        help='show runtime statistics of running instances and exit')
     p.add_argument('files', nargs='*', help='files to open')
     for item in self.items:
       item.prime_argparser(p)
@@ -198,6 +216,7 @@ class Config(GObject.GObject, logs.LoggerMixin):
       ns.logging_level = 'debug'
     self.files = [os.path.abspath(os.path.expanduser(p)) for p in ns.files]
     self.remote = ns.remote
+    self.stats = ns.stats
     self.version = ns.version
     return ns
 
@@ -210,6 +229,21 @@ class Config(GObject.GObject, logs.LoggerMixin):
   def get(self, key):
     return self.values.get(key)
 
+  def get_int(self, key) -> int:
+    """A value as a whole number, or its default if it is not one."""
+    v = self.get(key)
+    try:
+      return int(v)
+    except (TypeError, ValueError):
+      default = next(item.default for item in self.items if item.key == key)
+      self.error(f'{key[1]} in [{key[0]}] should be a whole number, not '
+                 f'{v!r}, using {default}')
+      return int(default)
+
+  @property
+  def session_file(self) -> Gio.File:
+    return self.root.get_child('session.json')
+
   @classmethod
   def generate_help(cls):
     section = None
@@ -4,43 +4,536 @@
 
 """The Bominade file browser."""
 
-import os
+import bisect, collections, mmap, os, re, time
 
 from gi.repository import Gio, GLib, GObject, Gdk, Gtk, GdkPixbuf, Pango
 
-from b8 import ui
+from b8 import ui, logs, repositories
 
 
-DEFAULT_FILE_ATTRIBUTES = '*'
+# Only what the browser actually uses. In particular we want the fast content
+# type, guessed from the name, since asking for the icon or the content type
+# makes GIO sniff the contents of every file.
+DEFAULT_FILE_ATTRIBUTES = ','.join([
+    Gio.FILE_ATTRIBUTE_STANDARD_NAME,
+    Gio.FILE_ATTRIBUTE_STANDARD_TYPE,
+    Gio.FILE_ATTRIBUTE_STANDARD_IS_HIDDEN,
+    Gio.FILE_ATTRIBUTE_STANDARD_FAST_CONTENT_TYPE,
+])
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+# The first batch is about a screenful, so it shows up straight away. After
+# that bigger batches mean fewer trips around the main loop.
+FIRST_BATCH_SIZE = 64
+BATCH_SIZE = 1000
+
+# Object, name, git status and its color. Icons are drawn from the object.
+MODEL_COLUMNS = [0, 1, 2, 3]
+
+# Runs of digits in names sort by their value, so file2 comes before file10.
+DIGITS_RE = re.compile(r'(\d+)')
+
+# Directories we have browsed stay cached, and up to PREFETCH_SIZE more are
+# loaded in advance because we think they will be browsed next.
+LISTINGS_SIZE = 32
+PREFETCH_SIZE = 16
+PREFETCH_CHILDREN = 8
+
+# Collapsed directories in the tree are unloaded after this many seconds.
+UNLOAD_DELAY = 60
+
+# The only child of a directory in the tree that has not been loaded, so that
+# it can be expanded.
+PLACEHOLDER = [None, 'Loading…', '', None]
+
+# The preview shows at most this much of the start of a file, and calls it
+# binary if there is a NUL in it.
+PREVIEW_SIZE = 16 * 1024
+
+# Wait for the selection to settle before previewing, in milliseconds.
+PREVIEW_DELAY = 150
+
+GIT_STATUS_COLORS = {
+  'M': ui.Colors.RED,
+  '??': ui.Colors.GREEN,
+}
+
+
+class IconCache:
+  """Icons shared between all the items in file lists.
+
+  A directory of thousands of files of the same type would otherwise load the
+  same pixbuf thousands of times. Icons are keyed by the tuple of icon names
+  and the size, and the cache is emptied when the icon theme changes.
+  """
+
+  def __init__(self, size: int=Gtk.IconSize.SMALL_TOOLBAR):
+    self.size = size
+    self.theme = None
+    self.icons = {}
+    self.names = {}
+
+  def for_content_type(self, content_type: str) -> GdkPixbuf.Pixbuf:
+    names = self.names.get(content_type)
+    if names is None:
+      icon = Gio.content_type_get_icon(content_type)
+      names = self.names[content_type] = tuple(icon.get_names())
+    return self.lookup(names)
+
+  def lookup(self, names: tuple) -> GdkPixbuf.Pixbuf:
+    key = (names, self.size)
+    try:
+      return self.icons[key]
+    except KeyError:
+      pass
+    icon_to_load = self._get_theme().choose_icon(list(names), self.size, 0)
+    if icon_to_load:
+      icon = icon_to_load.load_icon()
+    else:
+      icon = None
+    self.icons[key] = icon
+    return icon
+
+  def clear(self):
+    self.icons.clear()
+
+  def _get_theme(self) -> Gtk.IconTheme:
+    if not self.theme:
+      self.theme = Gtk.IconTheme.get_default()
+      self.theme.connect('changed', self._on_theme_changed)
+    return self.theme
+
+  def _on_theme_changed(self, theme):
+    self.clear()
+
+
+ICONS = IconCache()
+
+
+def collate_key(name: str) -> tuple:
+  """A key sorting names case insensitively and numbers by value."""
+  parts = DIGITS_RE.split(name.casefold())
+  parts[1::2] = map(int, parts[1::2])
+  # The name itself separates names that only differ in case or zeros.
+  return tuple(parts), name
 
 
 class FileListItem:
   """Item to go in the file list.
 
-  This is a thin wrapper over a Gio.FileInfo.
+  Only the few fields every row needs are kept from the Gio.FileInfo. The
+  Gio.File is made the first time it is asked for, usually when it is
+  activated. The icon is looked up in the shared `IconCache` whenever the row
+  is drawn.
   """
 
-  def __init__(self, info: Gio.FileInfo, parent: Gio.File):
-    self.info = info
+  __slots__ = ['parent', 'parent_path', 'name', 'file_type', 'hidden',
+               'content_type', 'is_directory', 'sort_key', '_file']
+
+  def __init__(self, info: Gio.FileInfo, parent: Gio.File,
+               parent_path: str=None):
     self.parent = parent
+    self.parent_path = parent_path or parent.get_path()
     self.name = info.get_name()
-    self.path = parent.get_child(self.name).get_path()
-    self.file = parent.get_child(self.name)
-    icon_to_load = Gtk.IconTheme.get_default().choose_icon(
-        self.info.get_icon().get_names(),
-        Gtk.IconSize.SMALL_TOOLBAR, 0
-    )
-    if icon_to_load:
-      self.icon = icon_to_load.load_icon()
-    else:
-      self.icon = None
-    self.file_type = self.info.get_file_type()
+    self.file_type = info.get_file_type()
+    self.hidden = info.get_is_hidden()
+    self.content_type = info.get_attribute_string(
+        Gio.FILE_ATTRIBUTE_STANDARD_FAST_CONTENT_TYPE) or DEFAULT_CONTENT_TYPE
     self.is_directory = self.file_type == Gio.FileType.DIRECTORY
-    if self.is_directory:
-      self.sort_prefix = 0
+    self.sort_key = (0 if self.is_directory else 1, collate_key(self.name))
+    self._file = None
+
+  @property
+  def path(self) -> str:
+    return os.path.join(self.parent_path, self.name)
+
+  @property
+  def file(self) -> Gio.File:
+    if self._file is None:
+      self._file = self.parent.get_child(self.name)
+    return self._file
+
+  @property
+  def icon(self) -> GdkPixbuf.Pixbuf:
+    # Not kept here, so a change of icon theme reaches every row.
+    return ICONS.for_content_type(self.content_type)
+
+  def get_sort_key(self) -> tuple:
+    return self.sort_key
+
+
+class Listing(GObject.GObject, logs.LoggerMixin):
+  """The contents of a directory, kept current by a file monitor.
+
+  Items arrive in batches while the directory is first enumerated. After that
+  the monitor reports single additions, removals and changes.
+  """
+
+  __gtype_name__ = 'b8-files-listing'
+
+  __gsignals__ = {
+    'batch': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+    'loaded': (GObject.SignalFlags.RUN_FIRST, None, ()),
+    'added': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+    'removed': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+    'changed': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+  }
+
+  directory = GObject.Property(type=Gio.File)
+  monitor = GObject.Property(type=Gio.FileMonitor)
+  loaded = GObject.Property(type=bool, default=False)
+
+  def __init__(self, directory: Gio.File):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.directory = directory
+    self.path = directory.get_path()
+    self.items = {}
+    self.priority = GLib.PRIORITY_DEFAULT
+    self.cancellable = Gio.Cancellable()
+    # How many are showing it, see `Listings.pin`.
+    self.users = 0
+
+  def load(self, priority: int=GLib.PRIORITY_DEFAULT):
+    self.priority = priority
+    # Monitor first, so nothing that happens while we enumerate is missed.
+    try:
+      self.monitor = self.directory.monitor_directory(
+          Gio.FileMonitorFlags.WATCH_MOVES, None)
+      self.monitor.connect('changed', self._on_monitor_changed)
+    except GLib.Error as e:
+      self.debug(f'unable to monitor {self.path}: {e.message}')
+    self.directory.enumerate_children_async(
+      DEFAULT_FILE_ATTRIBUTES,
+      Gio.FileQueryInfoFlags.NONE,
+      priority,
+      self.cancellable,
+      self._on_enumerate,
+    )
+
+  def close(self):
+    """Stop following the directory, and abandon any loading."""
+    self.cancellable.cancel()
+    if self.monitor:
+      self.monitor.cancel()
+
+  def _on_enumerate(self, src, res):
+    try:
+      enumerator = src.enumerate_children_finish(res)
+    except GLib.Error as e:
+      self._failed(e)
+      return
+    enumerator.next_files_async(FIRST_BATCH_SIZE, self.priority,
+        self.cancellable, self._on_batch)
+
+  def _on_batch(self, enumerator, res):
+    try:
+      infos = enumerator.next_files_finish(res)
+    except GLib.Error as e:
+      enumerator.close_async(GLib.PRIORITY_LOW, None, None)
+      self._failed(e)
+      return
+    if not infos:
+      enumerator.close_async(GLib.PRIORITY_LOW, None, None)
+      self._finish()
+      return
+    items = []
+    for info in infos:
+      name = info.get_name()
+      # The monitor may have beaten us to it.
+      if name in self.items:
+        continue
+      f = self.items[name] = FileListItem(info, self.directory, self.path)
+      items.append(f)
+    self.emit('batch', items)
+    enumerator.next_files_async(BATCH_SIZE, self.priority, self.cancellable,
+        self._on_batch)
+
+  def _finish(self):
+    self.loaded = True
+    self.emit('loaded')
+
+  def _failed(self, e: GLib.Error):
+    # Nobody is waiting for a cancelled listing, it is no longer cached.
+    if e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+      return
+    self.error(f'unable to list {self.path}: {e.message}')
+    self._finish()
+
+  def _on_monitor_changed(self, monitor, f, other, event):
+    if event in (Gio.FileMonitorEvent.CREATED,
+                 Gio.FileMonitorEvent.MOVED_IN):
+      self._query(f)
+    elif event in (Gio.FileMonitorEvent.DELETED,
+                   Gio.FileMonitorEvent.MOVED_OUT):
+      self._remove(f.get_basename())
+    elif event == Gio.FileMonitorEvent.RENAMED:
+      self._remove(f.get_basename())
+      self._query(other)
+    elif event in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                   Gio.FileMonitorEvent.ATTRIBUTE_CHANGED):
+      # Ask again, as it may be something else now, even a directory.
+      if f.get_basename() in self.items:
+        self._query(f)
+
+  def _query(self, f: Gio.File):
+    f.query_info_async(DEFAULT_FILE_ATTRIBUTES, Gio.FileQueryInfoFlags.NONE,
+        GLib.PRIORITY_LOW, self.cancellable, self._on_query)
+
+  def _on_query(self, f, res):
+    try:
+      info = f.query_info_finish(res)
+    except GLib.Error:
+      # Gone again already, or we were closed.
+      return
+    item = FileListItem(info, self.directory, self.path)
+    exists = item.name in self.items
+    self.items[item.name] = item
+    self.emit('changed' if exists else 'added', item)
+
+  def _remove(self, name: str):
+    item = self.items.pop(name, None)
+    if item:
+      self.emit('removed', item)
+
+
+class Listings:
+  """Recently browsed directory listings.
+
+  Browsed listings are kept in least recently used order. Prefetched listings
+  are kept separately, so that guessing does not push out what was really
+  browsed, and are promoted when they are browsed. Listings that are showing,
+  like every expanded directory of the tree, are pinned and never evicted or
+  cancelled, however many there are.
+  """
+
+  def __init__(self, size: int=LISTINGS_SIZE,
+               prefetch_size: int=PREFETCH_SIZE):
+    self.size = size
+    self.prefetch_size = prefetch_size
+    self.listings = collections.OrderedDict()
+    self.prefetched = collections.OrderedDict()
+
+  def get(self, directory: Gio.File) -> Listing:
+    path = directory.get_path()
+    l = self.listings.pop(path, None) or self.prefetched.pop(path, None)
+    if l is None:
+      l = Listing(directory)
+      l.load()
+    # Make room first, so the one asked for is never what goes.
+    self._evict(self.listings, self.size - 1)
+    self.listings[path] = l
+    return l
+
+  def prefetch(self, directory: Gio.File):
+    path = directory.get_path()
+    if path in self.listings or path in self.prefetched:
+      return
+    l = self.prefetched[path] = Listing(directory)
+    l.load(GLib.PRIORITY_LOW)
+    self._evict(self.prefetched, self.prefetch_size)
+
+  def pin(self, listing: Listing):
+    """Keep a listing while it is showing."""
+    listing.users += 1
+
+  def unpin(self, listing: Listing):
+    listing.users -= 1
+    self._evict(self.listings, self.size)
+
+  def cancel_loading(self, keep: Listing):
+    """Drop every unpinned listing still loading, apart from keep.
+
+    The subdirectories of keep being prefetched are kept too.
+    """
+    for cache in [self.listings, self.prefetched]:
+      for path, l in list(cache.items()):
+        if (l is keep or l.loaded or l.users or
+            os.path.dirname(path) == keep.path):
+          continue
+        del cache[path]
+        l.close()
+
+  def invalidate(self, directory: Gio.File):
+    path = directory.get_path()
+    for cache in [self.listings, self.prefetched]:
+      l = cache.pop(path, None)
+      if l:
+        l.close()
+
+  def _evict(self, cache, size):
+    excess = len(cache) - size
+    for path, l in list(cache.items()):
+      if excess <= 0:
+        break
+      if not l.users:
+        del cache[path]
+        l.close()
+        excess -= 1
+
+
+def read_head(path: str, size: int=PREVIEW_SIZE):
+  """The start of a file and whether it is binary, without reading the rest.
+
+  Mapping the file means only the pages we look at are ever read, however big
+  the file is.
+  """
+  with open(path, 'rb') as f:
+    try:
+      with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        head = m[:size]
+    except ValueError:
+      # Empty files cannot be mapped.
+      return b'', False
+  return head, b'\0' in head
+
+
+class Preview(Gtk.ScrolledWindow, logs.LoggerMixin):
+  """Shows the start of a file, without opening it in NeoVim."""
+
+  __gtype_name__ = 'b8-files-preview'
+
+  def __init__(self):
+    Gtk.ScrolledWindow.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.view = Gtk.TextView()
+    self.view.set_editable(False)
+    self.view.set_cursor_visible(False)
+    self.view.set_monospace(True)
+    self.add(self.view)
+
+  def show_file(self, f: FileListItem):
+    """Preview an item, or clear the preview if it is not a regular file."""
+    if f is None or f.file_type != Gio.FileType.REGULAR:
+      self.set_text('')
+      return
+    try:
+      head, binary = read_head(f.path)
+    except OSError as e:
+      self.set_text(f'Unable to preview: {e.strerror}')
+      return
+    if binary:
+      self.set_text('Binary file')
     else:
-      self.sort_prefix = 1
-    self.sort_key = f'{self.sort_prefix}_{self.name}'
+      self.set_text(head.decode('utf-8', 'replace'))
+
+  def set_text(self, text: str):
+    self.view.get_buffer().set_text(text)
+    self.get_vadjustment().set_value(0)
+
+
+class TreeNode:
+  """A loaded directory in the tree view, following its listing.
+
+  Rows are kept in order as they are inserted, as sorting a whole tree store
+  on every insert would be quadratic.
+  """
+
+  def __init__(self, files, listing: Listing, giter: Gtk.TreeIter):
+    self.files = files
+    self.store = files.tree_store
+    self.listing = listing
+    self.giter = giter
+    self.path = listing.path
+    self.rows = {}
+    self.keys = []
+    self.collapsed_at = None
+    files.listings.pin(listing)
+    self.handlers = [
+      listing.connect('loaded', self.on_loaded),
+      listing.connect('added', self.on_added),
+      listing.connect('removed', self.on_removed),
+      listing.connect('changed', self.on_changed),
+    ]
+    if listing.loaded:
+      self.fill()
+
+  def close(self):
+    if not self.handlers:
+      return
+    for handler in self.handlers:
+      self.listing.disconnect(handler)
+    self.handlers = []
+    self.files.listings.unpin(self.listing)
+
+  def visible(self, f: FileListItem) -> bool:
+    return self.files.show_hidden or not f.hidden
+
+  def fill(self):
+    """Replace the placeholder with the directory contents."""
+    # Removing the placeholder first would collapse the row.
+    placeholders = self.store.iter_n_children(self.giter)
+    items = sorted((f for f in self.listing.items.values() if self.visible(f)),
+        key=FileListItem.get_sort_key)
+    self.keys = [f.sort_key for f in items]
+    for f in items:
+      self.rows[f.name] = self.insert(f, -1)
+    for i in range(placeholders):
+      self.store.remove(self.store.iter_children(self.giter))
+
+  def clear(self):
+    giter = self.store.iter_children(self.giter)
+    while giter and self.store.remove(giter):
+      pass
+    self.rows = {}
+    self.keys = []
+
+  def unload(self):
+    """Forget the contents, leaving just the placeholder."""
+    self.close()
+    self.clear()
+    self.store.append(self.giter, PLACEHOLDER)
+
+  def insert(self, f: FileListItem, position: int) -> Gtk.TreeIter:
+    mod, color = self.files.git_status(f)
+    giter = self.store.insert_with_values(self.giter, position, MODEL_COLUMNS,
+        [f, f.name, mod, color])
+    if f.is_directory:
+      self.store.append(giter, PLACEHOLDER)
+    return giter
+
+  def refresh_status(self):
+    for name, giter in self.rows.items():
+      f = self.store.get_value(giter, 0)
+      mod, color = self.files.git_status(f)
+      self.store.set(giter, [2, 3], [mod, color])
+
+  def on_loaded(self, listing):
+    self.fill()
+
+  def on_added(self, listing, f):
+    self.files.worktree_changed(f)
+    if not listing.loaded or not self.visible(f):
+      return
+    position = bisect.bisect(self.keys, f.sort_key)
+    self.keys.insert(position, f.sort_key)
+    self.rows[f.name] = self.insert(f, position)
+
+  def on_removed(self, listing, f):
+    self.files.worktree_changed(f)
+    giter = self.rows.pop(f.name, None)
+    if giter:
+      del self.keys[bisect.bisect_left(self.keys, f.sort_key)]
+      self.files.close_nodes(f.path)
+      self.store.remove(giter)
+
+  def on_changed(self, listing, f):
+    self.files.worktree_changed(f)
+    giter = self.rows.get(f.name)
+    if not giter:
+      return
+    old = self.store.get_value(giter, 0)
+    if old.sort_key == f.sort_key:
+      self.store.set(giter, [0], [f])
+      return
+    # It belongs somewhere else now, and may have become a directory.
+    del self.keys[bisect.bisect_left(self.keys, old.sort_key)]
+    self.files.close_nodes(old.path)
+    self.store.remove(giter)
+    position = bisect.bisect(self.keys, f.sort_key)
+    self.keys.insert(position, f.sort_key)
+    self.rows[f.name] = self.insert(f, position)
 
 
 class Files(Gtk.VBox, ui.MenuHandlerMixin):
@@ -58,6 +551,7 @@ class Files(Gtk.VBox, ui.MenuHandlerMixin):
 
   directory = GObject.Property(type=Gio.File)
   show_hidden = GObject.Property(type=bool, default=False)
+  tree_mode = GObject.Property(type=bool, default=False)
 
   def __init__(self):
     """Generate the user interface."""
@@ -65,24 +559,48 @@ class Files(Gtk.VBox, ui.MenuHandlerMixin):
     self.title = self.create_title_label()
     self.pack_start(self.create_toolbar(), False, False, 0)
     c = Gtk.ScrolledWindow()
-    self.pack_start(c, True, True, 0)
+    self.preview = Preview()
+    self.preview.set_no_show_all(True)
+    self.preview_timeout = None
+    split = Gtk.VPaned()
+    split.pack1(c, resize=True, shrink=False)
+    split.pack2(self.preview, resize=True, shrink=True)
+    self.pack_start(split, True, True, 0)
     self.model = self.create_model()
+    self.tree_store = self.create_tree_store()
     self.tree = self.create_tree(self.model)
     c.add(self.tree)
+    self.nodes = {}
+    self.listings = Listings()
+    self.listing = None
+    self.listing_handlers = []
+    self.rows = {}
+    # The visible items in model order, and once sorted their keys.
+    self.items = []
+    self.keys = []
+    self.repositories = repositories.Repositories()
+    self.repository = None
+    self.repository_handler = None
     self.connect('notify::directory', self.on_directory_notify)
 
   def create_model(self):
     """Create the tree model."""
-    m = Gtk.ListStore(
+    # Kept in order by us rather than by a sort column, see `sort_rows`.
+    return Gtk.ListStore(
+        object,
+        GObject.TYPE_STRING, # name
+        GObject.TYPE_STRING, # mod
+        Gdk.RGBA, # mod color
+    )
+
+  def create_tree_store(self):
+    """Create the model for tree mode, which has the same columns."""
+    return Gtk.TreeStore(
         object,
-        GObject.TYPE_STRING, # sort key
-        GdkPixbuf.Pixbuf, # icon
         GObject.TYPE_STRING, # name
         GObject.TYPE_STRING, # mod
         Gdk.RGBA, # mod color
     )
-    m.set_sort_column_id(1, Gtk.SortType.ASCENDING)
-    return m
 
   def create_tree(self, m: Gtk.ListStore):
     """Create the tree view."""
@@ -91,26 +609,41 @@ class Files(Gtk.VBox, ui.MenuHandlerMixin):
     t.set_headers_visible(False)
     t.connect('row-activated', self.on_row_activated)
     t.connect('button-press-event', self.on_button_press_event)
+    t.connect('row-expanded', self.on_row_expanded)
+    t.connect('row-collapsed', self.on_row_collapsed)
+    t.get_selection().connect('changed', self.on_selection_changed)
+    # Every row is the same height, so only the visible rows are measured and
+    # drawn, and so only their icons are ever loaded.
+    t.set_fixed_height_mode(True)
 
     ce_icon = Gtk.CellRendererPixbuf()
     co_icon = Gtk.TreeViewColumn('Icon', ce_icon)
-    co_icon.add_attribute(ce_icon, 'pixbuf', 2)
+    co_icon.set_cell_data_func(ce_icon, self.render_icon)
+    co_icon.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+    co_icon.set_fixed_width(Gtk.icon_size_lookup(ICONS.size)[1] + 8)
     t.append_column(co_icon)
 
     ce_mods = Gtk.CellRendererText()
     ce_mods.set_property('weight', 800)
     co_mods = Gtk.TreeViewColumn('Modifiers', ce_mods)
-    co_mods.add_attribute(ce_mods, 'markup', 4)
-    co_mods.add_attribute(ce_mods, 'foreground-rgba', 5)
+    co_mods.add_attribute(ce_mods, 'markup', 2)
+    co_mods.add_attribute(ce_mods, 'foreground-rgba', 3)
+    co_mods.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+    co_mods.set_fixed_width(28)
     t.append_column(co_mods)
 
     ce_name = Gtk.CellRendererText()
     co_name = Gtk.TreeViewColumn('Filename', ce_name)
     co_name.set_expand(True)
-    co_name.add_attribute(ce_name, 'text', 3)
+    co_name.add_attribute(ce_name, 'text', 1)
+    co_name.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
     t.append_column(co_name)
     return t
 
+  def render_icon(self, column, cell, model, giter, data):
+    f = model.get_value(giter, 0)
+    cell.set_property('pixbuf', f.icon if f else None)
+
   def create_title_label(self):
     """Create the current directory label"""
     l = Gtk.Label()
@@ -138,6 +671,16 @@ class Files(Gtk.VBox, ui.MenuHandlerMixin):
             tooltip='Start a terminal in this directory',
           ),
           self.title,
+          ui.ImageToggleButton(
+            key='tree',
+            icon='format-indent-more',
+            tooltip='Show directories as a tree',
+          ),
+          ui.ImageToggleButton(
+            key='preview',
+            icon='document-print-preview',
+            tooltip='Preview the selected file',
+          ),
           ui.ImageToggleButton(
             key='hidden',
             icon='view-more',
@@ -155,14 +698,12 @@ class Files(Gtk.VBox, ui.MenuHandlerMixin):
         return
 
     f = Gio.File.new_for_path(path)
-    f.enumerate_children_async(
-      DEFAULT_FILE_ATTRIBUTES,
-      Gio.FileQueryInfoFlags.NONE,
-      GLib.PRIORITY_DEFAULT,
-      None, # cancellable
-      self.browse_path_callback,
-      f,
-    )
+    if refresh:
+      self.listings.invalidate(f)
+    listing = self.listings.get(f)
+    self.show_listing(listing)
+    # Whatever we were loading for the last directory is no longer wanted.
+    self.listings.cancel_loading(keep=listing)
 
   def browse(self, gfile: Gio.File, refresh: bool=True):
     self.browse_path(gfile.get_path(), refresh=refresh)
@@ -171,68 +712,206 @@ class Files(Gtk.VBox, ui.MenuHandlerMixin):
     """Refresh the current path."""
     self.browse(self.directory, refresh=True)
 
-  def browse_path_callback(self, src, res, parent: Gio.File) -> None:
-    """Async callback for finishing a File list enumeration."""
+  def show_listing(self, listing: Listing):
+    """Fill the model from a listing, and follow its changes."""
+    for handler in self.listing_handlers:
+      self.listing.disconnect(handler)
+    self.listing_handlers = []
+    self.listings.pin(listing)
+    if self.listing:
+      self.listings.unpin(self.listing)
+    self.listing = listing
+    self.rows = {}
+    self.items = []
+    self.keys = []
     self.model.clear()
-    self.directory = parent
-    for file_info in src.enumerate_children_finish(res):
-      if not self.show_hidden and file_info.get_is_hidden():
-        continue
-      f = FileListItem(file_info, parent)
-      self.append(f)
-    self.git_revparse()
-
-  def append(self, f):
-    """Append an item to the model."""
-    self.model.append([f, f.sort_key, f.icon, f.name, '', None])
-
-  def git_revparse_callback(self, src, res):
-    """Async callback for revparse command."""
-    success, stdout, stderr = src.communicate_finish(res)
-    if not success:
+    self.close_nodes()
+    self.tree_store.clear()
+    self.directory = listing.directory
+    self.show_repository(self.repositories.get(listing.path))
+    if self.tree_mode:
+      self.tree.set_model(self.tree_store)
+      self.nodes[listing.path] = TreeNode(self, listing, None)
+      return
+    self.tree.set_model(self.model)
+    self.listing_handlers = [
+      listing.connect('batch', self.on_listing_batch),
+      listing.connect('loaded', self.on_listing_loaded),
+      listing.connect('added', self.on_listing_added),
+      listing.connect('removed', self.on_listing_removed),
+      listing.connect('changed', self.on_listing_changed),
+    ]
+    self.append_items(listing.items.values())
+    if listing.loaded:
+      self.on_listing_loaded(listing)
+
+  def append_items(self, items):
+    """Append visible items to the model, in order."""
+    items = [f for f in items if self.visible(f)]
+    for f in sorted(items, key=FileListItem.get_sort_key):
+      self.insert(f, -1)
+
+  def insert(self, f: FileListItem, position: int):
+    """Insert an item into the model."""
+    mod, color = self.git_status(f)
+    self.rows[f.name] = self.model.insert_with_valuesv(position, MODEL_COLUMNS,
+        [f, f.name, mod, color])
+    if position < 0:
+      self.items.append(f)
+    else:
+      self.items.insert(position, f)
+
+  def sort_rows(self):
+    """Put the rows in order once everything is loaded.
+
+    Each batch was in order already, so usually this just merges them, and the
+    model is reordered in one go rather than sorted by GTK comparing strings.
+    """
+    order = sorted(range(len(self.items)), key=lambda i: self.items[i].sort_key)
+    if any(i != j for i, j in enumerate(order)):
+      self.model.reorder(order)
+      self.items = [self.items[i] for i in order]
+    self.keys = [f.sort_key for f in self.items]
+
+  def visible(self, f: FileListItem) -> bool:
+    return self.show_hidden or not f.hidden
+
+  def show_repository(self, repository: repositories.Repository):
+    """Follow the status of the repository we are in, if any."""
+    if repository is self.repository:
       return
-    d = stdout.get_data().strip().decode('utf-8')
-    self.git_status(Gio.File.new_for_path(d))
-
-  def git_revparse(self):
-    """Get the Git root directory."""
-    l = Gio.SubprocessLauncher()
-    l.set_flags(Gio.SubprocessFlags.STDOUT_PIPE | Gio.SubprocessFlags.STDERR_PIPE)
-    l.set_cwd(self.directory.get_path())
-    p = l.spawnv(['git', 'rev-parse', '--show-toplevel'])
-    p.communicate_async(None, None, self.git_revparse_callback)
-
-  def git_status_callback(self, src, res, parent):
-    """Async callback for finishing a git status call."""
-    success, stdout, stderr = src.communicate_finish(res)
-    if not success:
+    if self.repository_handler:
+      self.repository.disconnect(self.repository_handler)
+      self.repository_handler = None
+      # We have left that repository, it will catch up when we return.
+      self.repository.cancel()
+    self.repository = repository
+    if repository:
+      self.repository_handler = repository.connect('changed',
+          self.on_repository_changed)
+
+  def git_status(self, f: FileListItem):
+    """The status text and color for an item."""
+    mod = self.repository.get(f.path) if self.repository else None
+    if not mod:
+      return '', None
+    return mod, GIT_STATUS_COLORS.get(mod, ui.Colors.GREEN)
+
+  def on_repository_changed(self, repository):
+    for f in self.listing.items.values():
+      giter = self.rows.get(f.name)
+      if giter:
+        mod, color = self.git_status(f)
+        self.model.set(giter, [2, 3], [mod, color])
+    for node in self.nodes.values():
+      node.refresh_status()
+
+  def close_nodes(self, path: str=None):
+    """Stop following the tree nodes at and beneath path, or all of them."""
+    for p in list(self.nodes):
+      if path is None or p == path or p.startswith(path + os.sep):
+        self.nodes.pop(p).close()
+
+  def on_row_expanded(self, w, giter, path):
+    f = self.tree_store.get_value(giter, 0)
+    node = self.nodes.get(f.path)
+    if node:
+      node.collapsed_at = None
+      # Whatever was expanded beneath comes back collapsed, so unload it in
+      # its turn.
+      now = time.monotonic()
+      for p, n in self.nodes.items():
+        if p.startswith(f.path + os.sep) and n.collapsed_at is not None:
+          n.collapsed_at = now
+          GLib.timeout_add_seconds(UNLOAD_DELAY, self.on_unload_timeout, p)
       return
-    d = stdout.get_data().decode('utf-8').splitlines()
-    mods = {}
-    cols = {
-      'M': ui.Colors.RED,
-      '??': ui.Colors.GREEN,
-    }
-    for line in d:
-      line = line.strip().rstrip('/')
-      mod, name = line.split()
-      path = parent.get_child(name).get_path()
-      mods[path] = mod
-    for row in self.model:
-      path = self.model.get_value(row.iter, 0).file.get_path()
-      mod = mods.get(os.path.realpath(path))
-      if mod:
-        self.model.set_value(row.iter, 4, mod)
-        c = cols.get(mod, ui.Colors.GREEN)
-        self.model.set_value(row.iter, 5, c)
-
-  def git_status(self, parent):
-    """Call git status on the current directory."""
-    l = Gio.SubprocessLauncher()
-    l.set_flags(Gio.SubprocessFlags.STDOUT_PIPE | Gio.SubprocessFlags.STDERR_PIPE)
-    l.set_cwd(self.directory.get_path())
-    p = l.spawnv(['git', 'status', '--porcelain', '.'])
-    p.communicate_async(None, None, self.git_status_callback, parent)
+    listing = self.listings.get(f.file)
+    self.nodes[f.path] = TreeNode(self, listing, giter)
+
+  def on_row_collapsed(self, w, giter, path):
+    f = self.tree_store.get_value(giter, 0)
+    now = time.monotonic()
+    # Everything beneath is hidden too, and is unloaded along with this.
+    for p, node in self.nodes.items():
+      if p == f.path or p.startswith(f.path + os.sep):
+        if node.collapsed_at is None:
+          node.collapsed_at = now
+    GLib.timeout_add_seconds(UNLOAD_DELAY, self.on_unload_timeout, f.path)
+
+  def on_unload_timeout(self, path):
+    node = self.nodes.get(path)
+    if node and node.collapsed_at is not None and \
+        time.monotonic() - node.collapsed_at >= UNLOAD_DELAY:
+      self.close_nodes(path)
+      node.unload()
+    return False
+
+  def worktree_changed(self, f: FileListItem):
+    # Git looks after its own directory, and we watch the index anyway.
+    if self.repository and f.name != '.git':
+      self.repository.schedule()
+
+  def on_listing_batch(self, listing, items):
+    # Each batch at least appears in order while the rest is loading.
+    self.append_items(items)
+
+  def on_listing_loaded(self, listing):
+    self.sort_rows()
+    self.prefetch_children(listing)
+
+  def on_listing_added(self, listing, f):
+    if self.visible(f):
+      if listing.loaded:
+        position = bisect.bisect(self.keys, f.sort_key)
+        self.keys.insert(position, f.sort_key)
+        self.insert(f, position)
+      else:
+        self.insert(f, -1)
+    self.worktree_changed(f)
+
+  def on_listing_removed(self, listing, f):
+    giter = self.rows.pop(f.name, None)
+    if giter:
+      if listing.loaded:
+        position = bisect.bisect_left(self.keys, f.sort_key)
+        del self.keys[position]
+      else:
+        position = next(i for i, item in enumerate(self.items)
+            if item.name == f.name)
+      del self.items[position]
+      self.model.remove(giter)
+    self.worktree_changed(f)
+
+  def on_listing_changed(self, listing, f):
+    giter = self.rows.get(f.name)
+    if giter:
+      position = self.model.get_path(giter).get_indices()[0]
+      old = self.items[position]
+      self.items[position] = f
+      self.model.set(giter, [0], [f])
+      if listing.loaded and old.sort_key != f.sort_key:
+        self.move(position, f)
+    self.worktree_changed(f)
+
+  def move(self, position: int, f: FileListItem):
+    """Move the row at position to where f's sort key belongs."""
+    giter = self.rows[f.name]
+    del self.keys[position]
+    del self.items[position]
+    to = bisect.bisect(self.keys, f.sort_key)
+    self.keys.insert(to, f.sort_key)
+    self.items.insert(to, f)
+    # The row that will follow it, counting the row itself while it is still
+    # where it was.
+    following = to + 1 if to >= position else to
+    self.model.move_before(giter, self.model.iter_nth_child(None, following))
+
+  def prefetch_children(self, listing):
+    """Load the first few subdirectories, as they are likely browsed next."""
+    dirs = sorted(f.name for f in listing.items.values()
+        if f.is_directory and self.visible(f))
+    for name in dirs[:PREFETCH_CHILDREN]:
+      self.listings.prefetch(listing.items[name].file)
 
   def on_menu_activate(self, w, m, key, gfile):
     """Callback for menu item being activated."""
@@ -254,21 +933,61 @@ class Files(Gtk.VBox, ui.MenuHandlerMixin):
   def on_terminal_clicked(self, b):
     self.emit('terminal-activated', self.directory)
 
+  def on_tree_clicked(self, b):
+    self.tree_mode = b.get_active()
+    if self.listing:
+      self.show_listing(self.listing)
+
+  def on_preview_clicked(self, b):
+    if b.get_active():
+      self.preview.show_all()
+      self.show_preview()
+    else:
+      self.preview.hide()
+
+  def on_selection_changed(self, selection):
+    if not self.preview.get_visible():
+      return
+    # Only preview once the selection stops moving.
+    if self.preview_timeout is not None:
+      GLib.source_remove(self.preview_timeout)
+    self.preview_timeout = GLib.timeout_add(PREVIEW_DELAY,
+        self.on_preview_timeout)
+
+  def on_preview_timeout(self):
+    self.preview_timeout = None
+    self.show_preview()
+    return False
+
+  def show_preview(self):
+    m, giter = self.tree.get_selection().get_selected()
+    self.preview.show_file(m.get_value(giter, 0) if giter else None)
+
   def on_hidden_clicked(self, b):
     self.show_hidden = b.get_active()
-    self.refresh()
+    # Just a different filter over what we already have.
+    if self.listing:
+      self.show_listing(self.listing)
 
   def on_refresh_clicked(self, b):
     self.refresh()
+    if self.repository:
+      self.repository.refresh()
 
   def on_row_activated(self, w, path, column):
-    giter = self.model.get_iter(path)
-    f = self.model.get_value(giter, 0)
-    if f.is_directory:
+    m = w.get_model()
+    f = m.get_value(m.get_iter(path), 0)
+    if f is None:
+      return
+    if f.is_directory and self.tree_mode:
+      if w.row_expanded(path):
+        w.collapse_row(path)
+      else:
+        w.expand_row(path, False)
+    elif f.is_directory:
       self.emit('directory-activated', f.file)
     else:
-      child = self.directory.get_child(f.name)
-      self.emit('file-activated', child)
+      self.emit('file-activated', f.file)
 
   def on_button_press_event(self, w, event):
     if event.button != Gdk.BUTTON_SECONDARY:
@@ -277,8 +996,10 @@ class Files(Gtk.VBox, ui.MenuHandlerMixin):
     if not spec:
       return
     path, c, rx, ry = spec
-    giter = self.model.get_iter(path)
-    f = self.model.get_value(giter, 0)
+    m = w.get_model()
+    f = m.get_value(m.get_iter(path), 0)
+    if f is None:
+      return
     if f.is_directory:
       menu = ui.DirectoryPopupMenu(f.file)
     else:
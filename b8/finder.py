@@ -0,0 +1,502 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Find files anywhere in a project by typing part of their name.
+
+Each project root has a `FileIndex` of every file beneath it. In a Git
+worktree that comes from `git ls-files`, which already knows what is ignored,
+and is rebuilt when the repository status changes. Anywhere else the
+directory is walked a few directories at a time on idle, skipping hidden and
+ignored files.
+
+Matching is done in two steps. A regular expression finds the paths
+containing the typed letters in order, in one pass over the paths joined
+together, and then only the shortest of those are scored properly. The paths
+are kept shortest first and searched in chunks on idle, so a keystroke costs
+one chunk before the first results show, however big the project is. Each
+letter typed after that only has to narrow down the previous matches.
+"""
+
+import bisect, fnmatch, heapq, itertools, os, re, time
+
+from gi.repository import Gio, GLib, GObject, Gdk, Gtk
+
+from b8 import logs
+
+
+# Wait for a burst of changes to finish before reindexing.
+REINDEX_DELAY = 2000
+
+# Indexes of directories we cannot watch are rebuilt when this old.
+INDEX_TTL = 60
+
+# Directories walked per idle callback, and the most files a walk will index.
+WALK_BATCH = 50
+MAX_FILES = 500000
+
+# Never walked outside a Git worktree.
+IGNORED_NAMES = {'__pycache__', 'node_modules'}
+
+# Paths searched per idle callback.
+CHUNK_SIZE = 10000
+
+# Only this many of the shortest matching paths are scored, along with this
+# many of those whose name contains the query, however long their path.
+MAX_CANDIDATES = 2000
+
+MAX_RESULTS = 50
+
+
+def fuzzy_pattern(query: str, line: bool=False):
+  """Matches the letters of query in order, starting at the first.
+
+  Each later letter is preceded by everything that is not that letter, so the
+  expression never needs to backtrack, and starting with a literal letter lets
+  the regular expression engine skip quickly to candidates. With line set,
+  the rest of the line is consumed too, giving one match per line.
+  """
+  letters = [re.escape(c) for c in query]
+  parts = [letters[0]] + [f'[^\\n{c}]*{c}' for c in letters[1:]]
+  if line:
+    parts.append('[^\\n]*')
+  return re.compile(''.join(parts))
+
+
+def score(query: str, path: str, pattern) -> int:
+  """How well a lower case path matches, higher is better."""
+  base = path[path.rfind('/') + 1:]
+  s = -len(path)
+  i = base.find(query)
+  if i == 0:
+    s += 1000
+  elif i > 0:
+    s += 600
+  elif query in path:
+    s += 300
+  elif pattern.search(base):
+    s += 200
+  return s
+
+
+def read_ignores(path: str) -> list:
+  """The simple patterns in a .gitignore, as `(pattern, directories_only)`."""
+  try:
+    with open(os.path.join(path, '.gitignore')) as f:
+      lines = f.read().splitlines()
+  except (OSError, UnicodeDecodeError):
+    return []
+  ignores = []
+  for line in lines:
+    line = line.strip()
+    if not line or line.startswith(('#', '!')):
+      continue
+    ignores.append((line.strip('/'), line.endswith('/')))
+  return ignores
+
+
+class FileIndex(GObject.GObject, logs.LoggerMixin):
+  """Every file beneath a project root, as relative paths."""
+
+  __gtype_name__ = 'b8-finder-fileindex'
+
+  __gsignals__ = {
+    'updated': (GObject.SignalFlags.RUN_FIRST, None, ()),
+  }
+
+  root = GObject.Property(type=str)
+
+  def __init__(self, root: str):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.root = root
+    self.git = os.path.lexists(os.path.join(root, '.git'))
+    self.paths = []
+    self.lowered = []
+    self.chunks = []
+    self.building = None
+    self.built = None
+    self.loading = False
+    self.dirty = False
+    self.timeout = None
+    self.cancellable = None
+    self.repository = None
+    self.repository_handler = None
+    self.monitor = None
+    self.last_search = None
+
+  @property
+  def expired(self) -> bool:
+    if self.built is None:
+      return True
+    return not self.git and time.monotonic() - self.built > INDEX_TTL
+
+  def follow(self, repository):
+    """Reindex whenever the status of a repository changes."""
+    if repository is self.repository:
+      return
+    if self.repository_handler:
+      self.repository.disconnect(self.repository_handler)
+      self.repository_handler = None
+    self.repository = repository
+    if repository:
+      self.repository_handler = repository.connect('changed',
+          self._on_repository_changed)
+
+  def schedule(self):
+    if self.timeout is None:
+      self.timeout = GLib.timeout_add(REINDEX_DELAY, self._on_timeout)
+
+  def load(self):
+    """Rebuild in the background, keeping the old index until done."""
+    if self.loading:
+      self.dirty = True
+      return
+    self.loading = True
+    self.dirty = False
+    if self.git:
+      self._load_git()
+    else:
+      self._load_walk()
+
+  def close(self):
+    if self.cancellable:
+      self.cancellable.cancel()
+    if self.timeout is not None:
+      GLib.source_remove(self.timeout)
+      self.timeout = None
+    if self.monitor:
+      self.monitor.cancel()
+    self.follow(None)
+
+  def _on_timeout(self):
+    self.timeout = None
+    self.load()
+    return False
+
+  def _on_repository_changed(self, repository):
+    self.schedule()
+
+  def _load_git(self):
+    l = Gio.SubprocessLauncher()
+    l.set_flags(Gio.SubprocessFlags.STDOUT_PIPE |
+                Gio.SubprocessFlags.STDERR_SILENCE)
+    l.set_cwd(self.root)
+    try:
+      p = l.spawnv(['git', 'ls-files', '-z', '--cached', '--others',
+                    '--exclude-standard'])
+    except GLib.Error as e:
+      self.error(f'unable to run git: {e.message}')
+      self.loading = False
+      return
+    self.cancellable = Gio.Cancellable()
+    p.communicate_async(None, self.cancellable, self._on_ls_files)
+
+  def _on_ls_files(self, p, res):
+    try:
+      success, stdout, stderr = p.communicate_finish(res)
+    except GLib.Error as e:
+      self.debug(f'git ls-files failed: {e.message}')
+      self.loading = False
+      return
+    data = stdout.get_data() if stdout else b''
+    paths = data.decode('utf-8', 'surrogateescape').split('\0')
+    self._loaded([p for p in paths if p])
+
+  def _load_walk(self):
+    if self.monitor is None:
+      # Only the top level, watching everything would cost a watch for every
+      # directory. Deeper changes are caught by the index expiring.
+      try:
+        self.monitor = Gio.File.new_for_path(self.root).monitor_directory(
+            Gio.FileMonitorFlags.WATCH_MOVES, None)
+        self.monitor.connect('changed', self._on_root_changed)
+      except GLib.Error as e:
+        self.debug(f'unable to monitor {self.root}: {e.message}')
+    self.walking = []
+    self.walk = self._walk()
+    GLib.idle_add(self._on_walk_idle, priority=GLib.PRIORITY_LOW)
+
+  def _on_root_changed(self, monitor, f, other, event):
+    if event != Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+      self.schedule()
+
+  def _on_walk_idle(self):
+    for i in range(WALK_BATCH):
+      directory = next(self.walk, None)
+      if directory is None or len(self.walking) >= MAX_FILES:
+        paths = self.walking
+        self.walk = self.walking = None
+        self._loaded(paths)
+        return False
+    return True
+
+  def _walk(self):
+    """Walk the tree, yielding after each directory."""
+    stack = [('', [])]
+    while stack:
+      rel, inherited = stack.pop()
+      path = os.path.join(self.root, rel)
+      ignores = inherited + read_ignores(path)
+      try:
+        entries = list(os.scandir(path))
+      except OSError:
+        yield rel
+        continue
+      for e in entries:
+        if e.name.startswith('.') or e.name in IGNORED_NAMES:
+          continue
+        try:
+          is_dir = e.is_dir(follow_symlinks=False)
+        except OSError:
+          continue
+        if any(fnmatch.fnmatch(e.name, pattern) for pattern, dirs in ignores
+               if is_dir or not dirs):
+          continue
+        child = os.path.join(rel, e.name)
+        if is_dir:
+          stack.append((child, ignores))
+        else:
+          self.walking.append(child)
+      yield rel
+
+  def _loaded(self, paths: list):
+    # Shortest first, so the first matches found are the ones worth scoring.
+    paths.sort(key=len)
+    self.building = (paths, [], [])
+    GLib.idle_add(self._on_build_idle, priority=GLib.PRIORITY_LOW)
+
+  def _on_build_idle(self):
+    """Prepare the next chunk of a new index, swapping it in when done."""
+    paths, lowered, chunks = self.building
+    start = len(lowered)
+    if start < len(paths):
+      chunk = [p.lower() for p in paths[start:start + CHUNK_SIZE]]
+      lowered.extend(chunk)
+      # Where each path starts in the blob, to map matches back to paths.
+      offsets = list(itertools.accumulate((len(p) + 1 for p in chunk),
+          initial=0))
+      chunks.append((start, '\n'.join(chunk), offsets[:-1]))
+      return True
+    self.building = None
+    self.loading = False
+    self.cancellable = None
+    self.paths = paths
+    self.lowered = lowered
+    self.chunks = chunks
+    self.built = time.monotonic()
+    self.last_search = None
+    self.debug(f'indexed {len(paths)} files in {self.root}')
+    self.emit('updated')
+    if self.dirty:
+      self.load()
+    return False
+
+  def search(self, query: str):
+    """Start a search, which is then run a chunk at a time."""
+    return Search(self, query.lower().replace(' ', ''))
+
+  def _steps(self, query: str, pattern):
+    """Generate the indexes of matching paths, a chunk at a time."""
+    last = self.last_search
+    if last and last.done and query.startswith(last.query):
+      # Typing another letter can only narrow down the last matches.
+      lowered = self.lowered
+      matches = last.matches
+      for start in range(0, len(matches), CHUNK_SIZE):
+        yield [i for i in matches[start:start + CHUNK_SIZE]
+               if pattern.search(lowered[i])]
+      return
+    line = fuzzy_pattern(query, line=True)
+    for start, blob, offsets in self.chunks:
+      yield [start + bisect.bisect_right(offsets, m.start()) - 1
+             for m in line.finditer(blob)]
+
+
+class Search:
+  """A query over a `FileIndex`, run a chunk at a time."""
+
+  def __init__(self, index: FileIndex, query: str):
+    self.index = index
+    self.query = query
+    self.paths = index.paths
+    self.lowered = index.lowered
+    self.matches = []
+    # Matches whose name contains the query, which score best.
+    self.named = []
+    self.done = not query
+    if query:
+      self.pattern = fuzzy_pattern(query)
+      self.steps = index._steps(query, self.pattern)
+
+  def step(self) -> bool:
+    """Search the next chunk, returning whether there is more to do."""
+    if self.done:
+      return False
+    found = next(self.steps, None)
+    if found is None:
+      self.done = True
+      # Only a finished search has every match, to narrow down next time.
+      if self.paths is self.index.paths:
+        self.index.last_search = self
+      return False
+    self.matches.extend(found)
+    if len(self.named) < MAX_CANDIDATES:
+      q = self.query
+      lowered = self.lowered
+      self.named.extend(i for i in found
+          if q in lowered[i][lowered[i].rfind('/') + 1:])
+    return True
+
+  def results(self, limit: int=MAX_RESULTS) -> list:
+    """The best matching relative paths so far, best first."""
+    if not self.query:
+      return self.paths[:limit]
+    q = self.query
+    pattern = self.pattern
+    lowered = self.lowered
+    candidates = dict.fromkeys(self.matches[:MAX_CANDIDATES])
+    candidates.update(dict.fromkeys(self.named[:MAX_CANDIDATES]))
+    best = heapq.nlargest(limit, candidates,
+        key=lambda i: score(q, lowered[i], pattern))
+    return [self.paths[i] for i in best]
+
+
+class Finder(Gtk.Window, logs.LoggerMixin):
+  """Popup for finding and opening a file in the project."""
+
+  __gtype_name__ = 'b8-finder'
+
+  __gsignals__ = {
+    'file-activated': (GObject.SignalFlags.RUN_FIRST, None, (Gio.File,)),
+  }
+
+  def __init__(self):
+    Gtk.Window.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.set_decorated(False)
+    self.set_modal(True)
+    self.set_skip_taskbar_hint(True)
+    self.set_type_hint(Gdk.WindowTypeHint.DIALOG)
+    self.set_position(Gtk.WindowPosition.CENTER_ON_PARENT)
+    self.set_default_size(600, 400)
+    self.indexes = {}
+    self.index = None
+    self.current = None
+    self.searching = None
+    box = Gtk.VBox()
+    self.entry = Gtk.SearchEntry()
+    self.entry.connect('changed', self._on_entry_changed)
+    self.entry.connect('activate', self._on_entry_activate)
+    box.pack_start(self.entry, False, False, 0)
+    self.model = Gtk.ListStore(str, str) # path, markup
+    self.tree = self._create_tree(self.model)
+    c = Gtk.ScrolledWindow()
+    c.add(self.tree)
+    box.pack_start(c, True, True, 0)
+    self.add(box)
+    self.connect('key-press-event', self._on_key_press_event)
+    self.connect('focus-out-event', self._on_focus_out_event)
+
+  def _create_tree(self, m: Gtk.ListStore):
+    t = Gtk.TreeView(m)
+    t.set_headers_visible(False)
+    t.set_enable_search(False)
+    t.connect('row-activated', self._on_row_activated)
+    ce = Gtk.CellRendererText()
+    co = Gtk.TreeViewColumn('Path', ce)
+    co.add_attribute(ce, 'markup', 1)
+    t.append_column(co)
+    return t
+
+  def get_index(self, root: str, repository=None) -> FileIndex:
+    """The file index of the project at root, kept current."""
+    index = self.indexes.get(root)
+    if index is None:
+      index = self.indexes[root] = FileIndex(root)
+      index.connect('updated', self._on_index_updated)
+    if index.expired:
+      index.load()
+    index.follow(repository)
+    return index
+
+  def show_for(self, root: str, repository=None):
+    """Show the finder for the project at root."""
+    self.index = self.get_index(root, repository)
+    self.set_title(root)
+    self.search()
+    self.show_all()
+    self.present()
+    self.entry.grab_focus()
+
+  def search(self):
+    """Search for the text in the entry, replacing any running search."""
+    if self.searching is not None:
+      GLib.source_remove(self.searching)
+      self.searching = None
+    if self.index is None:
+      return
+    self.current = self.index.search(self.entry.get_text())
+    if self.current.step():
+      self.searching = GLib.idle_add(self._on_search_idle)
+    self.show_results()
+
+  def show_results(self):
+    self.model.clear()
+    for path in self.current.results():
+      directory, name = os.path.split(path)
+      name = GLib.markup_escape_text(name)
+      directory = GLib.markup_escape_text(directory)
+      markup = f'<b>{name}</b>  <span size="small">{directory}</span>'
+      self.model.append([path, markup])
+    if len(self.model):
+      self.tree.set_cursor(Gtk.TreePath.new_first(), None, False)
+
+  def activate_iter(self, giter):
+    path = os.path.join(self.index.root, self.model.get_value(giter, 0))
+    self.hide()
+    self.emit('file-activated', Gio.File.new_for_path(path))
+
+  def _on_index_updated(self, index):
+    if index is self.index and self.get_visible():
+      self.search()
+
+  def _on_search_idle(self):
+    found = len(self.current.matches)
+    named = len(self.current.named)
+    more = self.current.step()
+    # Later chunks only hold longer paths, which are not scored once there
+    # are enough candidates, unless their names contain the query.
+    if (found < MAX_CANDIDATES and len(self.current.matches) > found or
+        len(self.current.named) > named):
+      self.show_results()
+    if not more:
+      self.searching = None
+    return more
+
+  def _on_entry_changed(self, w):
+    self.search()
+
+  def _on_entry_activate(self, w):
+    model, giter = self.tree.get_selection().get_selected()
+    if giter:
+      self.activate_iter(giter)
+
+  def _on_row_activated(self, w, path, column):
+    self.activate_iter(self.model.get_iter(path))
+
+  def _on_key_press_event(self, w, event):
+    kn = Gdk.keyval_name(event.keyval)
+    if kn == 'Escape':
+      self.hide()
+      return True
+    moves = {'Up': -1, 'Down': 1}
+    if kn in moves and len(self.model):
+      model, giter = self.tree.get_selection().get_selected()
+      i = model.get_path(giter).get_indices()[0] if giter else -1
+      i = max(0, min(len(self.model) - 1, i + moves[kn]))
+      self.tree.set_cursor(Gtk.TreePath.new_from_indices([i]), None, False)
+      return True
+
+  def _on_focus_out_event(self, w, event):
+    self.hide()
@@ -0,0 +1,269 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Search the contents of the files in a project.
+
+Searches run `rg` if it is installed, then `git grep` inside a Git worktree,
+then plain `grep`, from the root of the worktree being browsed or otherwise
+the browsed directory. Output is read and parsed a chunk at a time as it
+arrives, so results appear straight away and a huge search never blocks the
+UI. There is a cap on the number of results, and starting a new search
+cancels the last.
+"""
+
+import os
+
+from gi.repository import Gio, GLib, GObject, Gtk, Pango
+
+from b8 import logs, ui, repositories
+
+
+# The search is stopped once it has found this many matches.
+MAX_RESULTS = 10000
+
+# Bytes of output read, and so parsed, at a time.
+READ_SIZE = 65536
+
+# Matched lines are cut to this many characters for showing.
+MAX_TEXT = 200
+
+
+def grep_argv(root: str, query: str, regex: bool):
+  """The command to run and the separator after its line numbers.
+
+  Every command is told to put a NUL after the path, which is the only way to
+  tell where a path with colons in it ends. Searches are case insensitive
+  unless the query has capitals in it.
+  """
+  icase = query.islower()
+  if GLib.find_program_in_path('rg'):
+    argv = ['rg', '--line-number', '--no-heading', '--color=never', '--null',
+            '--ignore-case' if icase else '--case-sensitive']
+    if not regex:
+      argv.append('--fixed-strings')
+    return argv + ['-e', query, '.'], b':'
+  if repositories.find_root(root) == root:
+    argv = ['git', 'grep', '-n', '-z', '-I', '--untracked']
+    sep = b'\0'
+  else:
+    argv = ['grep', '-rnIZ', '--exclude-dir=.git']
+    sep = b':'
+  if icase:
+    argv.append('-i')
+  argv.append('-E' if regex else '-F')
+  argv += ['-e', query]
+  if argv[0] == 'grep':
+    argv.append('.')
+  return argv, sep
+
+
+def parse_line(line: bytes, sep: bytes):
+  """`(path, line, text)` from a line of output, or None."""
+  path, nul, rest = line.partition(b'\0')
+  num, found, text = rest.partition(sep)
+  if not (nul and found and num.isdigit()):
+    return None
+  path = path.decode('utf-8', 'replace')
+  if path.startswith('./'):
+    path = path[2:]
+  text = text.decode('utf-8', 'replace').strip()[:MAX_TEXT]
+  return path, int(num), text
+
+
+class GrepProcess(GObject.GObject, logs.LoggerMixin):
+  """A running search, reporting results in batches as they are found."""
+
+  __gtype_name__ = 'b8-grep-process'
+
+  __gsignals__ = {
+    'results': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+    'finished': (GObject.SignalFlags.RUN_FIRST, None, (int, bool)),
+  }
+
+  def __init__(self):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.process = None
+    self.cancellable = None
+    self.sep = None
+    self.rest = b''
+    self.count = 0
+
+  def start(self, root: str, query: str, regex: bool=False):
+    self.cancel()
+    argv, self.sep = grep_argv(root, query, regex)
+    self.debug(f'searching {root} with {argv}')
+    l = Gio.SubprocessLauncher()
+    l.set_flags(Gio.SubprocessFlags.STDOUT_PIPE |
+                Gio.SubprocessFlags.STDERR_SILENCE)
+    l.set_cwd(root)
+    try:
+      self.process = l.spawnv(argv)
+    except GLib.Error as e:
+      self.error(f'unable to search: {e.message}')
+      self.emit('finished', 0, False)
+      return
+    self.cancellable = Gio.Cancellable()
+    self.rest = b''
+    self.count = 0
+    self._read()
+
+  def cancel(self):
+    if self.process is None:
+      return
+    self.cancellable.cancel()
+    self.process.force_exit()
+    self.process = None
+
+  def _read(self):
+    self.process.get_stdout_pipe().read_bytes_async(READ_SIZE,
+        GLib.PRIORITY_DEFAULT, self.cancellable, self._on_read, self.process)
+
+  def _on_read(self, stream, res, process):
+    if process is not self.process:
+      # Cancelled for a newer search.
+      return
+    try:
+      data = stream.read_bytes_finish(res).get_data()
+    except GLib.Error as e:
+      self.error(f'search failed: {e.message}')
+      self.process = None
+      self.emit('finished', self.count, False)
+      return
+    if data:
+      lines = (self.rest + data).split(b'\n')
+      self.rest = lines.pop()
+    else:
+      lines = [self.rest]
+    results = []
+    for line in lines:
+      r = parse_line(line, self.sep)
+      if r:
+        results.append(r)
+    truncated = self.count + len(results) >= MAX_RESULTS
+    if truncated:
+      del results[MAX_RESULTS - self.count:]
+    self.count += len(results)
+    if results:
+      self.emit('results', results)
+    if truncated:
+      self.cancel()
+    elif data:
+      self._read()
+      return
+    self.process = None
+    self.emit('finished', self.count, truncated)
+
+
+class Grep(Gtk.VBox, logs.LoggerMixin):
+  """Project search panel."""
+
+  __gtype_name__ = 'b8-grep'
+
+  __gsignals__ = {
+    'location-activated': (GObject.SignalFlags.RUN_FIRST, None,
+        (Gio.File, int)),
+  }
+
+  directory = GObject.Property(type=Gio.File)
+  regex = GObject.Property(type=bool, default=False)
+
+  def __init__(self):
+    Gtk.VBox.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.root = None
+    self.entry = Gtk.SearchEntry()
+    self.entry.connect('activate', self.on_entry_activate)
+    self.pack_start(self.create_toolbar(), False, False, 0)
+    self.status = Gtk.Label()
+    self.status.set_ellipsize(Pango.EllipsizeMode.START)
+    self.status.set_xalign(0)
+    self.pack_start(self.status, False, False, 0)
+    self.model = Gtk.ListStore(str, int, str) # path, line, markup
+    self.tree = self.create_tree(self.model)
+    c = Gtk.ScrolledWindow()
+    c.add(self.tree)
+    self.pack_start(c, True, True, 0)
+    self.grep = GrepProcess()
+    self.grep.connect('results', self.on_grep_results)
+    self.grep.connect('finished', self.on_grep_finished)
+
+  def create_toolbar(self):
+    t = ui.MiniToolbar.horizontal(
+        [
+          self.entry,
+          ui.ImageToggleButton(
+            key='regex',
+            icon='edit-find-replace',
+            tooltip='Search for a regular expression rather than text',
+          ),
+          ui.ImageButton(
+            key='stop',
+            icon='process-stop',
+            tooltip='Stop searching',
+          ),
+        ]
+    )
+    t.connect('clicked', self.on_toolbar_clicked)
+    return t
+
+  def create_tree(self, m: Gtk.ListStore):
+    t = Gtk.TreeView(m)
+    t.set_headers_visible(False)
+    t.set_enable_search(False)
+    t.connect('row-activated', self.on_row_activated)
+    ce = Gtk.CellRendererText()
+    ce.set_property('ellipsize', Pango.EllipsizeMode.END)
+    co = Gtk.TreeViewColumn('Match', ce)
+    co.add_attribute(ce, 'markup', 2)
+    t.append_column(co)
+    return t
+
+  def focus(self):
+    """Focus the entry, ready to type a search."""
+    self.entry.grab_focus()
+    self.entry.select_region(0, -1)
+
+  def search(self, query: str):
+    """Search the project being browsed."""
+    if not query or not self.directory:
+      return
+    path = self.directory.get_path()
+    self.root = repositories.find_root(path) or path
+    self.model.clear()
+    self.status.set_text(f'Searching {self.root}')
+    self.grep.start(self.root, query, self.regex)
+
+  def on_grep_results(self, grep, results):
+    for path, line, text in results:
+      location = GLib.markup_escape_text(f'{path}:{line}')
+      text = GLib.markup_escape_text(text)
+      markup = f'<span size="small">{location}</span>\n{text}'
+      self.model.append([path, line, markup])
+
+  def on_grep_finished(self, grep, count, truncated):
+    more = ', stopped at the limit' if truncated else ''
+    self.status.set_text(f'{count} matches in {self.root}{more}')
+
+  def on_entry_activate(self, w):
+    self.search(self.entry.get_text())
+
+  def on_toolbar_clicked(self, w, b, key):
+    fname = f'on_{key}_clicked'
+    f = getattr(self, fname)
+    f(b)
+
+  def on_regex_clicked(self, b):
+    self.regex = b.get_active()
+
+  def on_stop_clicked(self, b):
+    if self.grep.process:
+      self.grep.cancel()
+      self.on_grep_finished(self.grep, self.grep.count, False)
+
+  def on_row_activated(self, w, path, column):
+    giter = self.model.get_iter(path)
+    name, line = self.model.get(giter, 0, 1)
+    f = Gio.File.new_for_path(os.path.join(self.root, name))
+    self.emit('location-activated', f, line)
@@ -0,0 +1,299 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Record and replay the NeoVim RPC stream.
+
+A recording is a msgpack stream of `[seconds, data]` pairs, where `data` is a
+chunk of raw bytes exactly as it was read from NeoVim's stdout and `seconds` is
+the time since the recording started. Record with:
+
+    b8 --vim-record=/tmp/session.b8rec
+
+Then replay it, either into a real window through a fake NeoVim that serves
+the recording over stdin/stdout, or headlessly straight into the redraw
+handlers:
+
+    python3 -m b8.recordings replay /tmp/session.b8rec --realtime
+    python3 -m b8.recordings replay /tmp/session.b8rec --headless
+
+The fake NeoVim is just `python3 -m b8.recordings serve FILE`, which can be
+used as `Embedded.argv` to run the whole startup path without NeoVim.
+"""
+
+import argparse, os, select, sys, time
+from typing import Iterator, List, Tuple
+
+import msgpack
+from gi.repository import GLib, GObject
+
+from b8 import logs
+
+
+class Recorder:
+  """Writes raw data read from NeoVim, with timestamps, to a file."""
+
+  def __init__(self, path: str):
+    self.path = path
+    self.packer = msgpack.Packer(use_bin_type=True)
+    self.started = time.monotonic()
+    self.f = open(path, 'wb')
+
+  def write(self, data: bytes):
+    t = time.monotonic() - self.started
+    self.f.write(self.packer.pack([t, data]))
+    # Recordings are for reproducing problems, including crashes.
+    self.f.flush()
+
+  def close(self):
+    self.f.close()
+
+
+def read_frames(path: str) -> Iterator[Tuple[float, bytes]]:
+  """Iterate the raw `(seconds, data)` frames of a recording."""
+  with open(path, 'rb') as f:
+    for t, data in msgpack.Unpacker(f, raw=False):
+      yield t, data
+
+
+class Recording:
+  """A recording decoded into NeoVim notifications.
+
+  Replies and requests are dropped since they belong to a session that no
+  longer exists, and replaying them would confuse whoever receives them.
+  """
+
+  def __init__(self, path: str):
+    self.path = path
+    self.frames = []
+    unpacker = msgpack.Unpacker(raw=False)
+    for t, data in read_frames(path):
+      unpacker.feed(data)
+      msgs = [msg for msg in unpacker if msg[0] == 2]
+      if msgs:
+        self.frames.append((t, msgs))
+
+  @property
+  def duration(self) -> float:
+    if not self.frames:
+      return 0.0
+    return self.frames[-1][0]
+
+  def notifications(self) -> Iterator[list]:
+    for t, msgs in self.frames:
+      yield from msgs
+
+
+class Replay(GObject.GObject, logs.LoggerMixin):
+  """Replay a recording into an `Embedded` on the main loop.
+
+  Only redraws are replayed. The other notifications, like buffer events and
+  the clipboard, make requests back to a NeoVim that is not there.
+  """
+
+  __gtype_name__ = 'b8-recordings-replay'
+
+  __gsignals__ = {
+    'finished': (GObject.SignalFlags.RUN_FIRST, None, ()),
+  }
+
+  realtime = GObject.Property(type=bool, default=False)
+
+  def __init__(self, vim, recording: Recording, realtime: bool=False):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.vim = vim
+    self.recording = recording
+    self.realtime = realtime
+    self.position = 0
+
+  def start(self):
+    if not self.realtime:
+      for msg in self.recording.notifications():
+        self._replay(msg)
+      self.emit('finished')
+      return
+    self.started = time.monotonic()
+    self._schedule()
+
+  def _schedule(self):
+    if self.position >= len(self.recording.frames):
+      self.emit('finished')
+      return
+    t, msgs = self.recording.frames[self.position]
+    delay = t - (time.monotonic() - self.started)
+    GLib.timeout_add(max(0, int(delay * 1000)), self._on_frame_due)
+
+  def _on_frame_due(self):
+    t, msgs = self.recording.frames[self.position]
+    self.position += 1
+    for msg in msgs:
+      self._replay(msg)
+    self._schedule()
+    return False
+
+  def _replay(self, msg):
+    if msg[1] == 'redraw':
+      self.vim._notification_callback(msg[1:])
+
+
+class FakeNvim:
+  """Speaks just enough of the NeoVim UI protocol to serve a recording.
+
+  Every request gets an empty successful reply, apart from those in
+  `REPLIES`. Once the UI attaches the recorded notifications are written out,
+  either as fast as possible or with their recorded timing.
+  """
+
+  REPLIES = {
+      'nvim_get_api_info': [1, {}],
+  }
+
+  def __init__(self, recording: Recording, realtime: bool=False,
+               stdin=None, stdout=None):
+    self.recording = recording
+    self.realtime = realtime
+    self.stdin = stdin or sys.stdin.buffer
+    self.stdout = stdout or sys.stdout.buffer
+    self.packer = msgpack.Packer(use_bin_type=True)
+    self.unpacker = msgpack.Unpacker(raw=False)
+    self.attached = None
+    self.position = 0
+
+  def serve(self):
+    fd = self.stdin.fileno()
+    while True:
+      timeout = self._next_timeout()
+      readable, _, _ = select.select([fd], [], [], timeout)
+      if readable:
+        d = os.read(fd, 65536)
+        if not d:
+          return
+        self.unpacker.feed(d)
+        for msg in self.unpacker:
+          self._on_message(msg)
+      self._write_due_frames()
+
+  def _next_timeout(self):
+    if self.attached is None or self.position >= len(self.recording.frames):
+      return None
+    if not self.realtime:
+      return 0
+    t, msgs = self.recording.frames[self.position]
+    return max(0, t - (time.monotonic() - self.attached))
+
+  def _write_due_frames(self):
+    if self.attached is None:
+      return
+    elapsed = time.monotonic() - self.attached
+    while self.position < len(self.recording.frames):
+      t, msgs = self.recording.frames[self.position]
+      if self.realtime and t > elapsed:
+        break
+      self.position += 1
+      for msg in msgs:
+        self.stdout.write(self.packer.pack(msg))
+    self.stdout.flush()
+
+  def _on_message(self, msg):
+    if msg[0] != 0:
+      return
+    _, rid, name, args = msg
+    self.stdout.write(self.packer.pack([1, rid, None, self.REPLIES.get(name)]))
+    self.stdout.flush()
+    if name == 'nvim_ui_attach' and self.attached is None:
+      self.attached = time.monotonic()
+
+
+def fake_nvim_argv(path: str, realtime: bool=False) -> List[str]:
+  """The command line to use as `Embedded.argv` to serve a recording."""
+  argv = [sys.executable, '-m', 'b8.recordings', 'serve', path]
+  if realtime:
+    argv.append('--realtime')
+  return argv
+
+
+def _serve(ns):
+  FakeNvim(Recording(ns.path), realtime=ns.realtime).serve()
+
+
+def _info(ns):
+  r = Recording(ns.path)
+  counts = {}
+  for msg in r.notifications():
+    if msg[1] == 'redraw':
+      for event in msg[2]:
+        counts[event[0]] = counts.get(event[0], 0) + len(event) - 1
+    else:
+      counts[msg[1]] = counts.get(msg[1], 0) + 1
+  print(f'{ns.path}: {len(r.frames)} frames, {r.duration:.3f}s')
+  for name in sorted(counts, key=counts.get, reverse=True):
+    print(f'{counts[name]:10} {name}')
+
+
+def _replay(ns):
+  import gi
+  gi.require_version('Gtk', '3.0')
+  gi.require_version('PangoCairo', '1.0')
+  from gi.repository import Gtk
+  from b8 import vim
+
+  v = vim.Embedded()
+  if ns.headless:
+    r = Recording(ns.path)
+    replay = Replay(v, r, realtime=ns.realtime)
+    loop = GLib.MainLoop()
+
+    def on_finished(w):
+      loop.quit()
+
+    replay.connect('finished', on_finished)
+    started = time.perf_counter()
+    replay.start()
+    if ns.realtime:
+      loop.run()
+    taken = time.perf_counter() - started
+    print(f'replayed {len(r.frames)} frames in {taken:.3f}s '
+          f'(recorded over {r.duration:.3f}s)')
+    return
+
+  w = Gtk.Window()
+  w.resize(800, 600)
+  w.add(v)
+
+  def on_vim_ready(e):
+    w.show_all()
+
+  def on_delete(w, event):
+    Gtk.main_quit()
+
+  w.connect('delete-event', on_delete)
+  v.connect('ready', on_vim_ready)
+  v.argv = fake_nvim_argv(ns.path, ns.realtime)
+  v.start()
+  Gtk.main()
+
+
+def main():
+  p = argparse.ArgumentParser(prog='b8.recordings',
+      description='Replay recorded NeoVim RPC streams.')
+  sub = p.add_subparsers(dest='command', required=True)
+  for name, f, help in [
+      ('serve', _serve, 'act as a fake nvim --embed serving a recording'),
+      ('replay', _replay, 'replay a recording into the NeoVim widget'),
+      ('info', _info, 'summarize the events in a recording'),
+    ]:
+    sp = sub.add_parser(name, help=help)
+    sp.add_argument('path', help='the recording file')
+    sp.add_argument('--realtime', action='store_true',
+        help='keep the recorded timing rather than going flat out')
+    sp.set_defaults(func=f)
+    if name == 'replay':
+      sp.add_argument('--headless', action='store_true',
+          help='feed the redraw handlers without a window or NeoVim process')
+  ns = p.parse_args()
+  ns.func(ns)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,236 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Git status of whole repositories.
+
+There is one `Repository` for every Git worktree that has been browsed, shared
+by every directory inside it. Its status comes from a single `git status
+--porcelain=v2 -z` run from the root, and is only refreshed when the index
+changes or someone tells us the worktree did.
+"""
+
+import os
+
+from gi.repository import Gio, GLib, GObject
+
+from b8 import logs
+
+
+# Let a burst of changes settle before running git again.
+REFRESH_DELAY = 300
+
+# The status shown for a directory with changes somewhere beneath it, and one
+# with only untracked files beneath it.
+DIRECTORY_MODIFIED = 'M'
+UNTRACKED = '??'
+
+
+def find_root(path: str) -> str:
+  """The worktree containing path, or None, without running git."""
+  while True:
+    if os.path.lexists(os.path.join(path, '.git')):
+      return path
+    parent = os.path.dirname(path)
+    if parent == path:
+      return None
+    path = parent
+
+
+def find_git_dir(root: str) -> str:
+  """The git directory of a worktree, following `gitdir:` files."""
+  git = os.path.join(root, '.git')
+  if os.path.isdir(git):
+    return git
+  try:
+    with open(git) as f:
+      line = f.readline().strip()
+  except OSError:
+    return None
+  if not line.startswith('gitdir:'):
+    return None
+  return os.path.normpath(os.path.join(root, line[len('gitdir:'):].strip()))
+
+
+def short_status(xy: str) -> str:
+  """Porcelain v2 `XY`, with unchanged sides dropped like porcelain v1."""
+  return xy.replace('.', '') or xy
+
+
+def parse_status(data: bytes) -> dict:
+  """Parse `git status --porcelain=v2 -z` into relative paths and statuses."""
+  statuses = {}
+  entries = iter(data.decode('utf-8', 'surrogateescape').split('\0'))
+  for entry in entries:
+    if not entry:
+      continue
+    kind = entry[0]
+    if kind == '1':
+      fields = entry.split(' ', 8)
+      statuses[fields[8]] = short_status(fields[1])
+    elif kind == '2':
+      fields = entry.split(' ', 9)
+      statuses[fields[9]] = short_status(fields[1])
+      # The original path of the rename or copy.
+      next(entries, None)
+    elif kind == 'u':
+      fields = entry.split(' ', 10)
+      statuses[fields[10]] = short_status(fields[1])
+    elif kind == '?':
+      statuses[entry[2:].rstrip('/')] = UNTRACKED
+  return statuses
+
+
+class Repository(GObject.GObject, logs.LoggerMixin):
+  """The cached status of one worktree."""
+
+  __gtype_name__ = 'b8-repositories-repository'
+
+  __gsignals__ = {
+    'changed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+  }
+
+  root = GObject.Property(type=str)
+
+  def __init__(self, root: str):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.root = root
+    self.statuses = {}
+    self.directories = {}
+    self.running = False
+    self.dirty = False
+    # Until we have a status that is known to be current.
+    self.stale = True
+    self.timeout = None
+    self.process = None
+    self.cancellable = None
+    self.index_monitor = None
+    git_dir = find_git_dir(root)
+    if git_dir:
+      index = Gio.File.new_for_path(os.path.join(git_dir, 'index'))
+      try:
+        self.index_monitor = index.monitor_file(Gio.FileMonitorFlags.NONE,
+            None)
+        self.index_monitor.connect('changed', self._on_index_changed)
+      except GLib.Error as e:
+        self.debug(f'unable to monitor {index.get_path()}: {e.message}')
+
+  def get(self, path: str) -> str:
+    """The status of a file, or the summary status of a directory."""
+    return self.statuses.get(path) or self.directories.get(path)
+
+  def schedule(self):
+    """Refresh soon, coalescing with any other requests."""
+    if self.timeout is None:
+      self.timeout = GLib.timeout_add(REFRESH_DELAY, self._on_timeout)
+
+  def refresh(self):
+    """Run git status now, or as soon as the current run finishes."""
+    if self.running:
+      self.dirty = True
+      return
+    self.running = True
+    self.dirty = False
+    l = Gio.SubprocessLauncher()
+    l.set_flags(Gio.SubprocessFlags.STDOUT_PIPE |
+                Gio.SubprocessFlags.STDERR_SILENCE)
+    l.set_cwd(self.root)
+    try:
+      # Without the optional lock, status never takes index.lock from the
+      # user's own git commands, nor rewrites the index we are watching.
+      p = l.spawnv(['git', '--no-optional-locks', 'status', '--porcelain=v2',
+                    '-z'])
+    except GLib.Error as e:
+      self.error(f'unable to run git: {e.message}')
+      self.running = False
+      return
+    self.process = p
+    self.cancellable = Gio.Cancellable()
+    p.communicate_async(None, self.cancellable, self._on_status)
+
+  def cancel(self):
+    """Abandon any pending or running git status, leaving us stale."""
+    if self.timeout is not None:
+      GLib.source_remove(self.timeout)
+      self.timeout = None
+      self.stale = True
+    if not self.running:
+      return
+    self.cancellable.cancel()
+    self.process.force_exit()
+    self.process = None
+    self.running = False
+    self.dirty = False
+    self.stale = True
+
+  def close(self):
+    self.cancel()
+    if self.index_monitor:
+      self.index_monitor.cancel()
+
+  def _on_timeout(self):
+    self.timeout = None
+    self.refresh()
+    return False
+
+  def _on_index_changed(self, monitor, f, other, event):
+    if event in (Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+                 Gio.FileMonitorEvent.CREATED,
+                 Gio.FileMonitorEvent.DELETED):
+      self.schedule()
+
+  def _on_status(self, p, res):
+    if p is not self.process:
+      # Cancelled, and maybe already superseded.
+      return
+    self.process = None
+    self.running = False
+    try:
+      success, stdout, stderr = p.communicate_finish(res)
+    except GLib.Error as e:
+      self.error(f'git status failed: {e.message}')
+      return
+    if success and p.get_successful():
+      self._update(parse_status(stdout.get_data()))
+    if self.dirty:
+      self.refresh()
+
+  def _update(self, relative: dict):
+    statuses = {}
+    directories = {}
+    for name, status in relative.items():
+      path = os.path.join(self.root, name)
+      statuses[path] = status
+      # Directories show modified if anything beneath them is, and untracked
+      # only if all there is beneath them is untracked.
+      summary = UNTRACKED if status == UNTRACKED else DIRECTORY_MODIFIED
+      parent = os.path.dirname(path)
+      while len(parent) > len(self.root):
+        if directories.get(parent) == DIRECTORY_MODIFIED:
+          break
+        directories[parent] = summary
+        parent = os.path.dirname(parent)
+    self.statuses = statuses
+    self.directories = directories
+    self.stale = False
+    self.emit('changed')
+
+
+class Repositories:
+  """Every repository seen so far, by root."""
+
+  def __init__(self):
+    self.repositories = {}
+
+  def get(self, path: str) -> Repository:
+    """The repository containing path, or None if it is not in one."""
+    root = find_root(path)
+    if root is None:
+      return None
+    r = self.repositories.get(root)
+    if r is None:
+      r = self.repositories[root] = Repository(root)
+    if r.stale and not r.running:
+      r.refresh()
+    return r
@@ -0,0 +1,213 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Search the scrollback of every terminal at once.
+
+Each terminal's text is copied into a `ScrollbackIndex` as it scrolls by. A
+burst of output only marks the terminal as changed, and the new rows are read
+a batch at a time from a timer, so a flood of output is never slowed down by
+indexing it. Rows that flood past faster than that are skipped, down to the
+most recent `INDEX_LINES`, which is also all that is kept for each terminal.
+Rows are only read once the cursor has left them, so every line is read once.
+"""
+
+import collections
+
+from gi.repository import GLib, GObject, Gtk, Pango, Vte
+
+from b8 import logs
+
+
+# Lines kept for searching in each terminal, and characters kept of each.
+INDEX_LINES = 10000
+MAX_LINE = 500
+
+# Wait this long after output before reading it, in milliseconds.
+INDEX_DELAY = 500
+
+# Rows of each terminal read every time round.
+INDEX_BATCH = 500
+
+# A search stops once it has found this many lines.
+MAX_RESULTS = 1000
+
+
+def read_row(term: Vte.Terminal, row: int, columns: int) -> str:
+  """The text of one row of a terminal."""
+  if hasattr(term, 'get_text_range_format'):
+    text, length = term.get_text_range_format(Vte.Format.TEXT, row, 0, row,
+        columns)
+  else:
+    # Before Vte 0.76, where the end column is included.
+    text, attributes = term.get_text_range(row, 0, row, columns - 1, None,
+        None)
+  return (text or '').rstrip()
+
+
+class TerminalLines:
+  """The lines of one terminal's scrollback, as `(row, text)`."""
+
+  def __init__(self):
+    self.lines = collections.deque(maxlen=INDEX_LINES)
+    # The next row to read.
+    self.row = 0
+    self.handler = None
+
+
+class ScrollbackIndex(GObject.GObject, logs.LoggerMixin):
+  """The recent output of every terminal, for searching."""
+
+  __gtype_name__ = 'b8-scrollback-index'
+
+  def __init__(self):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.terminals = collections.OrderedDict()
+    self.dirty = set()
+    self.timeout = None
+
+  def add(self, t):
+    lines = self.terminals[t] = TerminalLines()
+    lines.handler = t.term.connect('contents-changed',
+        self._on_contents_changed, t)
+
+  def remove(self, t):
+    lines = self.terminals.pop(t, None)
+    if lines:
+      t.term.disconnect(lines.handler)
+    self.dirty.discard(t)
+
+  def stop(self):
+    if self.timeout is not None:
+      GLib.source_remove(self.timeout)
+      self.timeout = None
+
+  def count(self, t) -> int:
+    lines = self.terminals.get(t)
+    return len(lines.lines) if lines else 0
+
+  def update(self, t) -> bool:
+    """Read a batch of new rows, and whether that was all of them."""
+    term = t.term
+    lines = self.terminals[t]
+    column, cursor = term.get_cursor_position()
+    # Rows before this have dropped out of the scrollback.
+    lower = int(term.get_vadjustment().get_lower())
+    if cursor < lines.row - term.get_row_count():
+      # Far behind where we were, so the terminal was reset.
+      lines.lines.clear()
+      lines.row = lower
+    elif cursor < lines.row:
+      # Moved back up the screen, to redraw it, so nothing new yet.
+      return True
+    while lines.lines and lines.lines[0][0] < lower:
+      lines.lines.popleft()
+    start = max(lines.row, lower, cursor - INDEX_LINES)
+    end = min(cursor, start + INDEX_BATCH)
+    columns = term.get_column_count()
+    for row in range(start, end):
+      text = read_row(term, row, columns)
+      if text:
+        lines.lines.append((row, text[:MAX_LINE]))
+    lines.row = max(lines.row, end)
+    return end >= cursor
+
+  def search(self, query: str, limit: int=MAX_RESULTS) -> list:
+    """`(terminal, row, text)` for lines containing query, newest first.
+
+    Searches are case insensitive unless the query has capitals in it.
+    """
+    icase = query.islower()
+    results = []
+    for t, lines in self.terminals.items():
+      lower = t.term.get_vadjustment().get_lower()
+      for row, text in reversed(lines.lines):
+        if row < lower:
+          break
+        if query in (text.lower() if icase else text):
+          results.append((t, row, text))
+          if len(results) >= limit:
+            return results
+    return results
+
+  def _on_contents_changed(self, term, t):
+    # Called for every burst of output, so only remember it for later.
+    self.dirty.add(t)
+    if self.timeout is None:
+      self.timeout = GLib.timeout_add(INDEX_DELAY, self._on_timeout)
+
+  def _on_timeout(self):
+    self.timeout = None
+    for t in list(self.dirty):
+      if self.update(t):
+        self.dirty.discard(t)
+    if self.dirty:
+      self.timeout = GLib.timeout_add(INDEX_DELAY, self._on_timeout)
+    return False
+
+
+class ScrollbackSearch(Gtk.VBox, logs.LoggerMixin):
+  """Panel for searching the output of every terminal."""
+
+  __gtype_name__ = 'b8-scrollback-search'
+
+  __gsignals__ = {
+    'line-activated': (GObject.SignalFlags.RUN_FIRST, None, (object, int)),
+  }
+
+  def __init__(self, index: ScrollbackIndex):
+    Gtk.VBox.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.index = index
+    self.entry = Gtk.SearchEntry()
+    self.entry.connect('search-changed', self._on_search_changed)
+    self.entry.connect('activate', self._on_search_changed)
+    self.pack_start(self.entry, False, False, 0)
+    self.status = Gtk.Label()
+    self.status.set_xalign(0)
+    self.pack_start(self.status, False, False, 0)
+    self.model = Gtk.ListStore(object, int, str) # terminal, row, markup
+    self.tree = self._create_tree(self.model)
+    c = Gtk.ScrolledWindow()
+    c.add(self.tree)
+    self.pack_start(c, True, True, 0)
+
+  def _create_tree(self, m: Gtk.ListStore):
+    t = Gtk.TreeView(m)
+    t.set_headers_visible(False)
+    t.set_enable_search(False)
+    t.connect('row-activated', self._on_row_activated)
+    ce = Gtk.CellRendererText()
+    ce.set_property('ellipsize', Pango.EllipsizeMode.END)
+    co = Gtk.TreeViewColumn('Line', ce)
+    co.add_attribute(ce, 'markup', 2)
+    t.append_column(co)
+    return t
+
+  def focus(self):
+    """Focus the entry, ready to type a search."""
+    self.entry.grab_focus()
+    self.entry.select_region(0, -1)
+
+  def search(self, query: str):
+    self.model.clear()
+    if not query:
+      self.status.set_text('')
+      return
+    results = self.index.search(query)
+    for t, row, text in results:
+      where = GLib.markup_escape_text(t.cwd.get_path() if t.cwd else '')
+      text = GLib.markup_escape_text(text)
+      markup = f'<span size="small">{where}</span>\n{text}'
+      self.model.append([t, row, markup])
+    more = ', stopped at the limit' if len(results) >= MAX_RESULTS else ''
+    self.status.set_text(f'{len(results)} lines in '
+                         f'{len(self.index.terminals)} terminals{more}')
+
+  def _on_search_changed(self, w):
+    self.search(self.entry.get_text())
+
+  def _on_row_activated(self, w, path, column):
+    t, row = self.model.get(self.model.get_iter(path), 0, 1)
+    self.emit('line-activated', t, row)
@@ -12,6 +12,9 @@ from b8 import logs
 
 logs.LoggerMixin.level = 0
 
+# Bytes read at a time, until a whole message has arrived.
+READ_SIZE = 8192
+
 
 class Runtime(GObject.GObject, logs.LoggerMixin):
 
@@ -80,10 +83,29 @@ class Service(Gio.SocketService, logs.LoggerMixin):
   def _on_reply(self, stream, task):
     stream.write_bytes_finish(task)
 
-  def _on_read(self, stream, task, conn):
-    bs = stream.read_bytes_finish(task) 
-    cmd, args = msgpack.unpackb(bs.get_data())
+  def _read(self, conn, unpacker):
+    stream = conn.get_input_stream()
+    stream.read_bytes_async(READ_SIZE, 0, None, self._on_read,
+        (conn, unpacker))
+
+  def _on_read(self, stream, task, data):
+    conn, unpacker = data
+    bs = stream.read_bytes_finish(task).get_data()
+    if not bs:
+      self.debug('connection closed before a whole request arrived')
+      return
+    unpacker.feed(bs)
+    try:
+      cmd, args = next(unpacker)
+    except StopIteration:
+      # Part of a request, so read the rest.
+      self._read(conn, unpacker)
+      return
     self.debug(f'incoming: {cmd} {args}')
+    if cmd == 'watch':
+      # The connection stays open and becomes a stream of grid frames.
+      self.b8._on_service_watch(conn)
+      return
     resp = self.b8._on_service(cmd, args)
     self.debug(f'outgoing: {resp}')
     out = conn.get_output_stream()
@@ -91,8 +113,7 @@ class Service(Gio.SocketService, logs.LoggerMixin):
         self._on_reply)
 
   def _on_incoming(self, svc, conn, *args):
-    stream = conn.get_input_stream()
-    stream.read_bytes_async(8192, 0, None, self._on_read, conn)
+    self._read(conn, msgpack.Unpacker())
 
   def _on_cmd_ping(self):
     return 'pong'
@@ -127,6 +148,10 @@ class Client(Gio.SocketClient, logs.LoggerMixin):
     self.info(f'received {resp}')
     return resp
 
+  def stats(self):
+    self.debug('calling stats')
+    return self.command('stats')
+
   def command(self, name, args=None):
     if not args:
       args = []
@@ -139,10 +164,16 @@ class Client(Gio.SocketClient, logs.LoggerMixin):
     msg = msgpack.packb([name, args])
     out.write_bytes(GLib.Bytes.new(msg))
     inp = conn.get_input_stream()
-    bs = inp.read_bytes(8192)
-    msg = msgpack.unpackb(bs.get_data())
-    self.debug(f'reply {msg}')
-    return msg
+    unpacker = msgpack.Unpacker()
+    while True:
+      bs = inp.read_bytes(READ_SIZE).get_data()
+      if not bs:
+        self.debug(f'no whole reply from {self.gfile.get_path()}')
+        return
+      unpacker.feed(bs)
+      for msg in unpacker:
+        self.debug(f'reply {msg}')
+        return msg
 
 
 
@@ -0,0 +1,98 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""What was open when b8 quit, so it can be opened again on start.
+
+A session is the open buffers with the line the cursor was on, the directory
+being browsed, and the working directories of the terminals. It is restored
+lazily: buffers are only added to NeoVim's buffer list until they are first
+visited, and terminals only start their shell when their tab is first shown.
+"""
+
+import json, os
+
+from gi.repository import GObject
+
+from b8 import logs
+
+
+SESSION_VERSION = 1
+
+
+class Session:
+  """The state worth keeping between runs."""
+
+  def __init__(self, buffers: list=None, current_buffer: str=None,
+               directory: str=None, terminals: list=None,
+               current_terminal: int=0):
+    # `(path, line)` pairs.
+    self.buffers = buffers or []
+    self.current_buffer = current_buffer
+    self.directory = directory
+    self.terminals = terminals or []
+    self.current_terminal = current_terminal
+
+  @classmethod
+  def from_dict(cls, d: dict):
+    return cls(
+        buffers=[(path, line) for path, line in d.get('buffers', [])],
+        current_buffer=d.get('current_buffer'),
+        directory=d.get('directory'),
+        terminals=d.get('terminals', []),
+        current_terminal=d.get('current_terminal', 0),
+    )
+
+  def to_dict(self) -> dict:
+    return {
+        'version': SESSION_VERSION,
+        'buffers': [[path, line] for path, line in self.buffers],
+        'current_buffer': self.current_buffer,
+        'directory': self.directory,
+        'terminals': self.terminals,
+        'current_terminal': self.current_terminal,
+    }
+
+  def existing_buffers(self) -> list:
+    """The buffers whose files are still there."""
+    return [(path, line) for path, line in self.buffers
+            if os.path.exists(path)]
+
+
+class Sessions(GObject.GObject, logs.LoggerMixin):
+  """Reads and writes the session file."""
+
+  __gtype_name__ = 'b8-sessions'
+
+  def __init__(self, path: str):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.path = path
+
+  def load(self) -> Session:
+    """The last session, or None if there is none we can read."""
+    try:
+      with open(self.path) as f:
+        d = json.load(f)
+    except FileNotFoundError:
+      return None
+    except (OSError, ValueError) as e:
+      self.error(f'unable to read session {self.path}: {e}')
+      return None
+    if d.get('version') != SESSION_VERSION:
+      self.debug(f'ignoring session version {d.get("version")}')
+      return None
+    return Session.from_dict(d)
+
+  def save(self, session: Session):
+    # Write and rename, so quitting halfway never leaves half a session.
+    tmp = f'{self.path}.tmp'
+    try:
+      with open(tmp, 'w') as f:
+        json.dump(session.to_dict(), f)
+      os.replace(tmp, self.path)
+    except OSError as e:
+      self.error(f'unable to save session {self.path}: {e}')
+      return
+    self.debug(f'saved session with {len(session.buffers)} buffers and '
+               f'{len(session.terminals)} terminals')
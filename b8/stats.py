@@ -0,0 +1,108 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Lightweight runtime statistics.
+
+These are always on, so they must cost next to nothing to record. Anything
+expensive, like sorting for percentiles, happens when they are queried.
+"""
+
+import collections, time
+
+
+class Histogram:
+  """Rolling window of the most recent samples, with percentiles."""
+
+  def __init__(self, size: int=1000):
+    self.samples = collections.deque(maxlen=size)
+    self.count = 0
+
+  def add(self, value: float):
+    self.samples.append(value)
+    self.count += 1
+
+  def percentile(self, p: float, ordered=None) -> float:
+    if ordered is None:
+      ordered = sorted(self.samples)
+    if not ordered:
+      return None
+    i = min(len(ordered) - 1, int(len(ordered) * p / 100.0))
+    return ordered[i]
+
+  def summary(self) -> dict:
+    ordered = sorted(self.samples)
+    return {
+        'count': self.count,
+        'window': len(ordered),
+        'p50': self.percentile(50, ordered),
+        'p95': self.percentile(95, ordered),
+        'p99': self.percentile(99, ordered),
+        'max': ordered[-1] if ordered else None,
+    }
+
+
+class Counters:
+  """Named counts, each with an optional cumulative time."""
+
+  def __init__(self):
+    self.counts = collections.defaultdict(int)
+    self.seconds = collections.defaultdict(float)
+
+  def add(self, name: str, count: int=1, seconds: float=0.0):
+    self.counts[name] += count
+    if seconds:
+      self.seconds[name] += seconds
+
+  def summary(self) -> dict:
+    out = {}
+    for name in sorted(self.counts):
+      out[name] = {'count': self.counts[name]}
+      if name in self.seconds:
+        out[name]['ms'] = self.seconds[name] * 1000
+    return out
+
+
+class Latency:
+  """Input to flush and input to paint latency, in milliseconds.
+
+  Each input is timestamped, then matched to the first flush that follows it,
+  and after that to the first paint following that flush.
+  """
+
+  # Bounds the pending inputs if NeoVim stops flushing or we stop painting.
+  MAX_PENDING = 1000
+
+  def __init__(self, size: int=1000):
+    self.to_flush = Histogram(size)
+    self.to_paint = Histogram(size)
+    self.pending = []
+    self.flushed = []
+
+  def input(self):
+    if len(self.pending) < self.MAX_PENDING:
+      self.pending.append(time.perf_counter())
+
+  def flush(self):
+    if not self.pending:
+      return
+    now = time.perf_counter()
+    for t in self.pending:
+      self.to_flush.add((now - t) * 1000)
+    self.flushed.extend(self.pending)
+    del self.flushed[:-self.MAX_PENDING]
+    self.pending = []
+
+  def paint(self):
+    if not self.flushed:
+      return
+    now = time.perf_counter()
+    for t in self.flushed:
+      self.to_paint.add((now - t) * 1000)
+    self.flushed = []
+
+  def summary(self) -> dict:
+    return {
+        'input_to_flush_ms': self.to_flush.summary(),
+        'input_to_paint_ms': self.to_paint.summary(),
+    }
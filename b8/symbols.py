@@ -0,0 +1,396 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Jump to the functions, classes and methods defined anywhere in a project.
+
+Each project has a `SymbolIndex`, built from the files of the finder's
+`FileIndex` and kept in an SQLite cache with the modification time of every
+file parsed. Files are parsed a batch at a time by `b8.tags`, in as many worker
+processes as there are cores, so a cold index uses every core and the UI never
+waits for it. The workers are started as `python3 -m b8.tags` rather than
+forked or spawned by multiprocessing, which would import all of b8 and GTK
+again in each of them. The workers skip files whose modification time has not
+changed, so a warm start, or an update after the file index changes, only
+parses what changed.
+"""
+
+import collections, json, os, sqlite3, sys
+
+from gi.repository import Gio, GLib, GObject, Gdk, Gtk
+
+from b8 import logs, tags
+
+
+CACHE_PATH = os.path.join(GLib.get_user_cache_dir(), 'b8', 'symbols.sqlite')
+
+# Files parsed by each task sent to a worker.
+TASK_SIZE = 200
+
+TAGS_ARGV = [sys.executable, '-m', 'b8.tags']
+
+MAX_RESULTS = 50
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+  path TEXT PRIMARY KEY,
+  root TEXT NOT NULL,
+  mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_root ON files (root);
+CREATE TABLE IF NOT EXISTS symbols (
+  root TEXT NOT NULL,
+  path TEXT NOT NULL,
+  name TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  line INTEGER NOT NULL,
+  container TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path);
+CREATE INDEX IF NOT EXISTS symbols_root ON symbols (root);
+'''
+
+
+def like_escape(s: str) -> str:
+  return s.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+class Cache:
+  """The symbols of every file parsed so far, on disk."""
+
+  def __init__(self, path: str=CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.db = sqlite3.connect(path)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    self.db.execute('PRAGMA synchronous=NORMAL')
+    self.db.executescript(SCHEMA)
+
+  def mtimes(self, root: str) -> dict:
+    """When each file of a project was parsed, by path."""
+    return dict(self.db.execute(
+        'SELECT path, mtime FROM files WHERE root = ?', (root,)))
+
+  def store(self, root: str, results: list):
+    """Save the results of `tags.parse_files`."""
+    with self.db:
+      for path, mtime, symbols in results:
+        self.db.execute('DELETE FROM symbols WHERE path = ?', (path,))
+        if mtime is None:
+          self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+          continue
+        self.db.execute(
+            'INSERT OR REPLACE INTO files (path, root, mtime) VALUES (?, ?, ?)',
+            (path, root, mtime))
+        self.db.executemany(
+            'INSERT INTO symbols (root, path, name, kind, line, container) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            [(root, path) + tuple(s) for s in symbols])
+
+  def remove(self, paths):
+    with self.db:
+      for path in paths:
+        self.db.execute('DELETE FROM symbols WHERE path = ?', (path,))
+        self.db.execute('DELETE FROM files WHERE path = ?', (path,))
+
+  def search(self, root: str, query: str, limit: int=MAX_RESULTS) -> list:
+    """`(name, kind, path, line, container)` for symbols containing query.
+
+    Names starting with the query come first, then shorter names.
+    """
+    q = like_escape(query)
+    return self.db.execute(
+        'SELECT name, kind, path, line, container FROM symbols '
+        "WHERE root = ? AND name LIKE ? ESCAPE '\\' "
+        "ORDER BY name NOT LIKE ? ESCAPE '\\', length(name), name LIMIT ?",
+        (root, f'%{q}%', f'{q}%', limit)).fetchall()
+
+  def close(self):
+    self.db.close()
+
+
+class Task:
+  """Files for a worker to parse, and who to tell when it has."""
+
+  def __init__(self, files: list, callback):
+    self.files = files
+    self.callback = callback
+    self.process = None
+    self.cancellable = None
+
+
+class Workers(GObject.GObject, logs.LoggerMixin):
+  """Runs `b8.tags` worker processes, a few at a time.
+
+  A worker that crashes only loses its own task, which is reported as failed.
+  """
+
+  __gtype_name__ = 'b8-symbols-workers'
+
+  def __init__(self, size: int=None):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.size = size or os.cpu_count() or 1
+    self.queue = collections.deque()
+    self.running = set()
+
+  def submit(self, files: list, callback) -> Task:
+    """Parse files, calling `callback(task, results)` with None on failure."""
+    task = Task(files, callback)
+    self.queue.append(task)
+    self._start_next()
+    return task
+
+  def cancel(self, task: Task):
+    if task in self.running:
+      self.running.remove(task)
+      task.cancellable.cancel()
+      task.process.force_exit()
+    elif task in self.queue:
+      self.queue.remove(task)
+
+  def shutdown(self):
+    for task in list(self.running) + list(self.queue):
+      self.cancel(task)
+
+  def _start_next(self):
+    while self.queue and len(self.running) < self.size:
+      self._start(self.queue.popleft())
+
+  def _start(self, task: Task):
+    l = Gio.SubprocessLauncher()
+    l.set_flags(Gio.SubprocessFlags.STDIN_PIPE |
+                Gio.SubprocessFlags.STDOUT_PIPE)
+    # Find the same b8 as we did, even when it is not installed.
+    root = os.path.dirname(os.path.dirname(os.path.abspath(tags.__file__)))
+    path = os.environ.get('PYTHONPATH')
+    l.setenv('PYTHONPATH', os.pathsep.join([root, path]) if path else root,
+        True)
+    try:
+      task.process = l.spawnv(TAGS_ARGV)
+    except GLib.Error as e:
+      self.error(f'unable to start a worker: {e.message}')
+      # Not straight away, as whoever submitted it is still holding the task.
+      GLib.idle_add(task.callback, task, None)
+      return
+    task.cancellable = Gio.Cancellable()
+    self.running.add(task)
+    data = GLib.Bytes.new(json.dumps(task.files).encode('utf-8'))
+    task.process.communicate_async(data, task.cancellable,
+        self._on_communicate, task)
+
+  def _on_communicate(self, process, res, task):
+    if task not in self.running:
+      # Cancelled.
+      return
+    self.running.remove(task)
+    try:
+      ok, out, err = process.communicate_finish(res)
+      if not process.get_successful():
+        raise ValueError('the worker failed')
+      results = json.loads(out.get_data())
+    except (GLib.Error, ValueError) as e:
+      self.error(f'unable to index symbols: {e}')
+      results = None
+    self._start_next()
+    task.callback(task, results)
+
+
+class SymbolIndex(GObject.GObject, logs.LoggerMixin):
+  """The symbols of a project, updated whenever its files are."""
+
+  __gtype_name__ = 'b8-symbols-symbolindex'
+
+  __gsignals__ = {
+    'updated': (GObject.SignalFlags.RUN_FIRST, None, ()),
+  }
+
+  root = GObject.Property(type=str)
+
+  def __init__(self, files, cache: Cache, pool: Workers):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.root = files.root
+    self.files = files
+    self.cache = cache
+    self.pool = pool
+    self.tasks = []
+    self.dirty = False
+    self.parsed = 0
+    self.files_handler = files.connect('updated', self._on_files_updated)
+    if files.built is not None:
+      self.update()
+
+  @property
+  def updating(self) -> bool:
+    return bool(self.tasks)
+
+  def update(self):
+    """Parse the files that changed, or as soon as the current update ends."""
+    if self.tasks:
+      self.dirty = True
+      return
+    self.dirty = False
+    self.parsed = 0
+    known = self.cache.mtimes(self.root)
+    paths = [os.path.join(self.root, p) for p in self.files.paths
+             if tags.wanted(p)]
+    self.cache.remove(set(known).difference(paths))
+    files = [(p, known.get(p)) for p in paths]
+    for i in range(0, len(files), TASK_SIZE):
+      self.tasks.append(self.pool.submit(files[i:i + TASK_SIZE],
+          self._on_task_done))
+
+  def close(self):
+    for task in self.tasks:
+      self.pool.cancel(task)
+    self.tasks = []
+    self.files.disconnect(self.files_handler)
+
+  def _on_files_updated(self, files):
+    self.update()
+
+  def _on_task_done(self, task, results):
+    if task not in self.tasks:
+      # Closed while the task was running.
+      return
+    self.tasks.remove(task)
+    if results:
+      self.cache.store(self.root, results)
+      self.parsed += len(results)
+    if not self.tasks:
+      self.debug(f'parsed {self.parsed} changed files in {self.root}')
+      self.emit('updated')
+      if self.dirty:
+        self.update()
+
+
+class Symbols(Gtk.Window, logs.LoggerMixin):
+  """Popup for finding a symbol in the project and jumping to it."""
+
+  __gtype_name__ = 'b8-symbols'
+
+  __gsignals__ = {
+    'location-activated': (GObject.SignalFlags.RUN_FIRST, None,
+        (Gio.File, int)),
+  }
+
+  def __init__(self):
+    Gtk.Window.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.set_decorated(False)
+    self.set_modal(True)
+    self.set_skip_taskbar_hint(True)
+    self.set_type_hint(Gdk.WindowTypeHint.DIALOG)
+    self.set_position(Gtk.WindowPosition.CENTER_ON_PARENT)
+    self.set_default_size(600, 400)
+    self.cache = None
+    self.pool = None
+    self.indexes = {}
+    self.index = None
+    box = Gtk.VBox()
+    self.entry = Gtk.SearchEntry()
+    self.entry.connect('changed', self._on_entry_changed)
+    self.entry.connect('activate', self._on_entry_activate)
+    box.pack_start(self.entry, False, False, 0)
+    self.model = Gtk.ListStore(str, int, str) # path, line, markup
+    self.tree = self._create_tree(self.model)
+    c = Gtk.ScrolledWindow()
+    c.add(self.tree)
+    box.pack_start(c, True, True, 0)
+    self.add(box)
+    self.connect('key-press-event', self._on_key_press_event)
+    self.connect('focus-out-event', self._on_focus_out_event)
+
+  def _create_tree(self, m: Gtk.ListStore):
+    t = Gtk.TreeView(m)
+    t.set_headers_visible(False)
+    t.set_enable_search(False)
+    t.connect('row-activated', self._on_row_activated)
+    ce = Gtk.CellRendererText()
+    co = Gtk.TreeViewColumn('Symbol', ce)
+    co.add_attribute(ce, 'markup', 2)
+    t.append_column(co)
+    return t
+
+  def get_index(self, files) -> SymbolIndex:
+    """The symbol index for the files of a project, started if need be."""
+    index = self.indexes.get(files.root)
+    if index is None:
+      if self.pool is None:
+        self.cache = Cache()
+        self.pool = Workers()
+      index = self.indexes[files.root] = SymbolIndex(files, self.cache,
+          self.pool)
+      index.connect('updated', self._on_index_updated)
+    return index
+
+  def show_for(self, files):
+    """Show the picker for the project with the given `finder.FileIndex`."""
+    self.index = self.get_index(files)
+    self.search()
+    self.show_all()
+    self.present()
+    self.entry.grab_focus()
+
+  def search(self):
+    self.model.clear()
+    root = self.index.root
+    indexing = ' (indexing…)' if self.index.updating else ''
+    self.set_title(f'{root}{indexing}')
+    query = self.entry.get_text().strip()
+    if not query:
+      return
+    for name, kind, path, line, container in self.cache.search(root, query):
+      name = GLib.markup_escape_text(f'{container}.{name}' if container
+          else name)
+      location = GLib.markup_escape_text(
+          f'{os.path.relpath(path, root)}:{line}')
+      markup = (f'<b>{name}</b>  <span size="small">{kind} in {location}'
+                '</span>')
+      self.model.append([path, line, markup])
+    if len(self.model):
+      self.tree.set_cursor(Gtk.TreePath.new_first(), None, False)
+
+  def activate_iter(self, giter):
+    path, line = self.model.get(giter, 0, 1)
+    self.hide()
+    self.emit('location-activated', Gio.File.new_for_path(path), line)
+
+  def shutdown(self):
+    for index in self.indexes.values():
+      index.close()
+    if self.pool:
+      self.pool.shutdown()
+    if self.cache:
+      self.cache.close()
+
+  def _on_index_updated(self, index):
+    if index is self.index and self.get_visible():
+      self.search()
+
+  def _on_entry_changed(self, w):
+    self.search()
+
+  def _on_entry_activate(self, w):
+    model, giter = self.tree.get_selection().get_selected()
+    if giter:
+      self.activate_iter(giter)
+
+  def _on_row_activated(self, w, path, column):
+    self.activate_iter(self.model.get_iter(path))
+
+  def _on_key_press_event(self, w, event):
+    kn = Gdk.keyval_name(event.keyval)
+    if kn == 'Escape':
+      self.hide()
+      return True
+    moves = {'Up': -1, 'Down': 1}
+    if kn in moves and len(self.model):
+      model, giter = self.tree.get_selection().get_selected()
+      i = model.get_path(giter).get_indices()[0] if giter else -1
+      i = max(0, min(len(self.model) - 1, i + moves[kn]))
+      self.tree.set_cursor(Gtk.TreePath.new_from_indices([i]), None, False)
+      return True
+
+  def _on_focus_out_event(self, w, event):
+    self.hide()
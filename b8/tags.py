@@ -0,0 +1,141 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Find the functions, classes and methods defined in source files.
+
+Python is parsed with `ast`, and other languages with Universal Ctags if it is
+installed. This runs in worker processes started as `python3 -m b8.tags`, so
+it must not import GTK.
+"""
+
+import ast, json, os, shutil, subprocess, sys
+
+
+# Bigger files are most likely generated, and not worth parsing.
+MAX_SIZE = 1024 * 1024
+
+PYTHON_EXTENSIONS = {'.py', '.pyi'}
+
+# Only these are given to ctags, which would otherwise read every binary.
+CTAGS_EXTENSIONS = {
+    '.c', '.h', '.cc', '.cpp', '.cxx', '.hh', '.hpp', '.go', '.rs', '.java',
+    '.js', '.jsx', '.ts', '.tsx', '.rb', '.php', '.lua', '.sh', '.cs', '.kt',
+    '.scala', '.swift', '.m', '.vim', '.el', '.ex', '.exs', '.erl', '.hs',
+}
+
+CTAGS_KINDS = {
+    'class', 'function', 'method', 'struct', 'interface', 'enum', 'trait',
+    'module', 'namespace', 'type', 'typedef', 'macro',
+}
+
+
+def wanted(path: str) -> bool:
+  """Whether we know how to parse path."""
+  ext = os.path.splitext(path)[1].lower()
+  return ext in PYTHON_EXTENSIONS or (ext in CTAGS_EXTENSIONS and has_ctags())
+
+
+_has_ctags = None
+
+
+def has_ctags() -> bool:
+  global _has_ctags
+  if _has_ctags is None:
+    _has_ctags = shutil.which('ctags') is not None
+  return _has_ctags
+
+
+def parse_python(source: bytes) -> list:
+  """The `(name, kind, line, container)` of every definition in source."""
+  symbols = []
+  stack = [(ast.parse(source), '', '')]
+  while stack:
+    node, container, container_kind = stack.pop()
+    for child in ast.iter_child_nodes(node):
+      if isinstance(child, ast.ClassDef):
+        kind = 'class'
+      elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        kind = 'method' if container_kind == 'class' else 'function'
+      else:
+        # Definitions inside if, try and with blocks still count, but there
+        # are none in expressions.
+        if isinstance(child, (ast.stmt, ast.excepthandler)):
+          stack.append((child, container, container_kind))
+        continue
+      symbols.append((child.name, kind, child.lineno, container))
+      name = f'{container}.{child.name}' if container else child.name
+      stack.append((child, name, kind))
+  return symbols
+
+
+def parse_ctags(paths: list) -> dict:
+  """Symbols by path for the given files, from a single run of ctags."""
+  try:
+    p = subprocess.run(['ctags', '--output-format=json', '--fields=+nKZ',
+                        '--sort=no', '-f', '-', '-L', '-'],
+        input='\n'.join(paths).encode('utf-8', 'surrogateescape'),
+        capture_output=True)
+  except OSError:
+    return {}
+  # Exuberant Ctags has no JSON output, and fails here.
+  if p.returncode != 0:
+    return {}
+  symbols = {path: [] for path in paths}
+  for line in p.stdout.splitlines():
+    try:
+      tag = json.loads(line)
+    except ValueError:
+      continue
+    if tag.get('_type') != 'tag' or tag.get('kind') not in CTAGS_KINDS:
+      continue
+    found = symbols.get(tag.get('path'))
+    if found is not None:
+      found.append((tag['name'], tag['kind'], tag.get('line', 1),
+                    tag.get('scope', '')))
+  return symbols
+
+
+def parse_files(files: list) -> list:
+  """Parse the files that changed since we last saw them.
+
+  Takes `(path, mtime)` pairs, where mtime is when the file was last parsed or
+  None, and returns `(path, mtime, symbols)` for every file that changed. Files
+  that are gone have a None mtime.
+  """
+  results = []
+  ctags = []
+  for path, known in files:
+    try:
+      st = os.stat(path)
+    except OSError:
+      if known is not None:
+        results.append((path, None, None))
+      continue
+    if st.st_mtime == known:
+      continue
+    if st.st_size > MAX_SIZE:
+      results.append((path, st.st_mtime, []))
+    elif os.path.splitext(path)[1].lower() in PYTHON_EXTENSIONS:
+      try:
+        with open(path, 'rb') as f:
+          symbols = parse_python(f.read())
+      except (OSError, SyntaxError, ValueError, RecursionError):
+        symbols = []
+      results.append((path, st.st_mtime, symbols))
+    else:
+      ctags.append((path, st.st_mtime))
+  if ctags:
+    found = parse_ctags([path for path, mtime in ctags])
+    for path, mtime in ctags:
+      results.append((path, mtime, found.get(path, [])))
+  return results
+
+
+def main():
+  """Parse the `(path, mtime)` pairs given as JSON on stdin, for b8.symbols."""
+  json.dump(parse_files(json.load(sys.stdin)), sys.stdout)
+
+
+if __name__ == '__main__':
+  main()
@@ -4,56 +4,162 @@
 
 """Bominade Terminal Emulator"""
 
-import webbrowser, os, pwd
+import collections, webbrowser, os, pwd, time
 
 from gi.repository import Gtk, Vte, GLib, GObject, Gio, Gdk, Pango
 
-from b8 import ui
+from b8 import ui, scrollback
 
 
-class CwdDiscovery(GObject.GObject):
-  """Discover the working directory of a running process."""
+# How often terminals without OSC 7 are checked, in milliseconds. Just after
+# typing we check quickly, doubling the wait while nothing changes.
+POLL_FAST = 250
+POLL_SLOW = 8000
 
-  __gtype_name__ = 'b8-terminals-cwddiscovery'
+# Every terminal keeps this many lines, unless the budget is too tight to give
+# them all that many.
+MIN_SCROLLBACK = 1000
 
-  cwd = GObject.Property(type=Gio.File)
-  running = GObject.Property(type=bool, default=False)
+# Wait for output to pause before sharing out the scrollback again, in
+# milliseconds.
+REBALANCE_DELAY = 2000
 
-  __gsignals__ = {
-    'cwd-changed': (GObject.SignalFlags.RUN_FIRST, None, (Gio.File,)),
-  }
+# Clicked paths are remembered for this many seconds, and at most this many.
+PATH_CACHE_TTL = 5
+PATH_CACHE_SIZE = 1000
+
+
+class PathCache:
+  """Recently clicked paths, and their file type or None if missing.
+
+  Paths are checked with an asynchronous query, so a click on a path on a slow
+  network mount does not freeze everything, and clicking it again soon after
+  does not ask again.
+  """
+
+  def __init__(self, ttl: float=PATH_CACHE_TTL):
+    self.ttl = ttl
+    self.entries = collections.OrderedDict()
+
+  def query(self, f: Gio.File, callback, *data):
+    """Call `callback(file_type, *data)`, straight away if we know."""
+    path = f.get_path()
+    entry = self.entries.get(path)
+    if entry and time.monotonic() - entry[0] < self.ttl:
+      callback(entry[1], *data)
+      return
+    f.query_info_async(Gio.FILE_ATTRIBUTE_STANDARD_TYPE,
+        Gio.FileQueryInfoFlags.NONE, GLib.PRIORITY_DEFAULT, None,
+        self._on_query, (callback, data))
+
+  def _on_query(self, f, res, user_data):
+    callback, data = user_data
+    try:
+      file_type = f.query_info_finish(res).get_file_type()
+    except GLib.Error:
+      file_type = None
+    self.entries[f.get_path()] = (time.monotonic(), file_type)
+    self.entries.move_to_end(f.get_path())
+    while len(self.entries) > PATH_CACHE_SIZE:
+      self.entries.popitem(last=False)
+    callback(file_type, *data)
+
+
+PATHS = PathCache()
 
-  def __init__(self, pid):
+
+class CwdTracker(GObject.GObject):
+  """Follows the working directory and foreground process of every terminal.
+
+  Shells that send OSC 7 tell Vte their directory, and we just listen. For the
+  rest, one timer reads `/proc` for every terminal at once. It polls quickly
+  after typing, and backs off while nothing changes. The foreground process
+  of each terminal is found in the same sweep.
+  """
+
+  __gtype_name__ = 'b8-terminals-cwdtracker'
+
+  def __init__(self):
     GObject.GObject.__init__(self)
-    self.pid = pid
-    self.connect('notify::cwd', self._on_cwd_changed)
+    self.terminals = []
+    self.timeout = None
+    self.interval = POLL_FAST
+
+  def add(self, t):
+    self.terminals.append(t)
+    t.term.connect('current-directory-uri-changed', self._on_uri_changed, t)
+    t.term.connect('commit', self._on_commit)
+    self.poke()
 
-  def start(self):
-    self.running = True
-    self.refresh()
-    GLib.timeout_add(1000, self.refresh)
+  def remove(self, t):
+    if t in self.terminals:
+      self.terminals.remove(t)
 
   def stop(self):
-    self.running = False
+    if self.timeout is not None:
+      GLib.source_remove(self.timeout)
+      self.timeout = None
 
-  def refresh(self):
+  def poke(self):
+    """Something probably changed, so sweep again soon."""
+    if self.timeout is not None and self.interval == POLL_FAST:
+      return
+    self.interval = POLL_FAST
+    self._schedule()
+
+  def sweep(self) -> bool:
+    """Check every running terminal, returning whether anything changed."""
+    changed = False
+    for t in self.terminals:
+      if t.pid <= 0:
+        continue
+      if not t.osc7:
+        try:
+          cwd = os.readlink(f'/proc/{t.pid}/cwd')
+        except OSError:
+          cwd = None
+        if cwd and (not t.cwd or t.cwd.get_path() != cwd):
+          t.set_cwd(Gio.File.new_for_path(cwd))
+          changed = True
+      process = self._foreground_process(t)
+      if process != t.process:
+        t.set_process(process)
+        changed = True
+    return changed
+
+  def _foreground_process(self, t) -> str:
     try:
-     l = Gio.File.new_for_path(self.proclink).query_info('*', 0, None)
-    except GLib.Error:
-      self.stop()
-      return False
-      
-    new = Gio.File.new_for_path(l.get_symlink_target())
-    if not self.cwd or (new.get_path() != self.cwd.get_path()):
-      self.cwd = new
-    return self.running
+      pgrp = os.tcgetpgrp(t.term.get_pty().get_fd())
+      with open(f'/proc/{pgrp}/comm') as f:
+        return f.read().strip()
+    except (OSError, AttributeError):
+      return ''
+
+  def _schedule(self):
+    self.stop()
+    if any(t.pid > 0 for t in self.terminals) or self.interval == POLL_FAST:
+      self.timeout = GLib.timeout_add(self.interval, self._on_timeout)
+
+  def _on_timeout(self):
+    self.timeout = None
+    if self.sweep():
+      self.interval = POLL_FAST
+    else:
+      self.interval = min(self.interval * 2, POLL_SLOW)
+    self._schedule()
+    return False
 
-  def _on_cwd_changed(self, w, prop):
-    self.emit('cwd-changed', self.cwd)
+  def _on_uri_changed(self, term, t):
+    uri = term.get_current_directory_uri()
+    if not uri:
+      return
+    t.osc7 = True
+    f = Gio.File.new_for_uri(uri)
+    if not t.cwd or t.cwd.get_path() != f.get_path():
+      t.set_cwd(f)
 
-  @property
-  def proclink(self):
-    return f'/proc/{self.pid}/cwd'
+  def _on_commit(self, term, text, size):
+    self.poke()
 
 
 class TerminalTheme(GObject.GObject):
@@ -108,21 +214,132 @@ class Terminals(Gtk.Notebook, ui.MenuHandlerMixin):
     'directory-activated': (GObject.SignalFlags.RUN_FIRST, None, (Gio.File,)),
   }
 
-  def __init__(self, font, theme):
+  def __init__(self, font, theme, scrollback_lines=-1):
     Gtk.Notebook.__init__(self)
     self.set_tab_pos(Gtk.PositionType.BOTTOM)
     self.set_scrollable(True)
     self.theme = TerminalTheme(theme, font)
+    self.starting = None
+    self.tracker = CwdTracker()
+    self.index = scrollback.ScrollbackIndex()
+    # Lines of scrollback shared by every terminal, or -1 for no limit.
+    self.scrollback = scrollback_lines
+    self.rebalancing = None
+    # Whether there was output since the timer was started.
+    self.changed_since = False
+    # Terminals, most recently shown last.
+    self.used = collections.OrderedDict()
+    self.connect('switch-page', self._on_switch_page)
+
+  def _new_terminal(self):
+    t = Terminal()
+    self.theme.apply(t.term)
+    self.tracker.add(t)
+    self.index.add(t)
+    t.term.connect('contents-changed', self._on_contents_changed)
+    self.used[t] = None
+    self.used.move_to_end(t, last=False)
+    # Its share comes out of the others' before it has any output.
+    self.rebalance()
+    return t
 
   def create(self, wd=None):
     if not wd:
       wd = os.path.expanduser('~')
-    t = Terminal()
-    self.theme.apply(t.term)
+    t = self._new_terminal()
     t.start(wd)
     self.append(t)
     t.term.grab_focus()
 
+  def restore(self, cwds: list, current: int=0):
+    """Add terminals that only start their shell when first shown."""
+    for wd in cwds:
+      t = self._new_terminal()
+      t.prepare(wd)
+      self.append_page(t, t.label)
+    self.show_all()
+    if self.get_n_pages():
+      self.set_current_page(max(0, min(current, self.get_n_pages() - 1)))
+
+  def session(self):
+    """The working directories of the terminals, and the current one."""
+    return ([t.cwd.get_path() for t in self.get_children() if t.cwd],
+            self.get_current_page())
+
+  def rebalance(self):
+    """Share the scrollback budget out, most recently shown first.
+
+    Every terminal keeps a minimum. The current terminal may grow into
+    whatever the others are not using, and at least half of what is left over
+    the minimums. The rest keep what they use while it lasts, so the
+    terminals that have not been looked at for longest are trimmed first. The
+    limits never add up to more than the budget.
+    """
+    if self.scrollback < 0 or not self.used:
+      return
+    terminals = list(reversed(self.used))
+    floor = min(MIN_SCROLLBACK, self.scrollback // len(terminals))
+    spare = self.scrollback - floor * len(terminals)
+    used = [t.scrollback_used() for t in terminals]
+    wanted = [max(0, u - floor) for u in used]
+    extras = [min(spare,
+        max(wanted[0], spare // 2, spare - sum(wanted[1:])))]
+    spare -= extras[0]
+    for w in wanted[1:]:
+      extras.append(min(w, spare))
+      spare -= extras[-1]
+    for t, u, extra in zip(terminals, used, extras):
+      limit = floor + extra
+      t.set_scrollback_limit(limit)
+      t.label.set_tooltip_text(f'{min(u, limit)} of {limit} lines of '
+                               'scrollback')
+
+  def stats(self) -> dict:
+    """Scrollback in use by each terminal, for sizing the budget."""
+    return {
+        'scrollback_budget': self.scrollback,
+        'terminals': [{
+            'cwd': t.cwd.get_path() if t.cwd else None,
+            'scrollback_used': t.scrollback_used(),
+            'scrollback_limit': t.scrollback_limit,
+            'indexed_lines': self.index.count(t),
+        } for t in reversed(self.used)],
+    }
+
+  def _on_contents_changed(self, term):
+    if self.scrollback < 0:
+      return
+    # At most once per delay while output keeps coming, and once more after
+    # it stops.
+    if self.rebalancing is None:
+      self.changed_since = False
+      self.rebalancing = GLib.timeout_add(REBALANCE_DELAY,
+          self._on_rebalance_timeout)
+    else:
+      self.changed_since = True
+
+  def _on_rebalance_timeout(self):
+    self.rebalance()
+    if self.changed_since:
+      self.changed_since = False
+      return True
+    self.rebalancing = None
+    return False
+
+  def _on_switch_page(self, w, page, n):
+    self.used.move_to_end(page)
+    self.rebalance()
+    # Pages switch as they are added too, so wait to see where we end up.
+    if self.starting is None:
+      self.starting = GLib.idle_add(self._on_start_idle)
+
+  def _on_start_idle(self):
+    self.starting = None
+    t = self.get_nth_page(self.get_current_page())
+    if t and not t.started:
+      t.start(t.wd)
+    return False
+
   def append(self, t):
     pagenum = self.append_page(t, t.label)
     self.show_all()
@@ -147,15 +364,33 @@ class Terminals(Gtk.Notebook, ui.MenuHandlerMixin):
     p = self.get_nth_page(n)
     p.term.grab_focus()
 
+  def show_row(self, t, row: int):
+    """Switch to a terminal, scrolled so row is in the middle."""
+    n = self.page_num(t)
+    if n < 0:
+      return
+    self.change_tab(n)
+    a = t.term.get_vadjustment()
+    value = row - a.get_page_size() // 2
+    a.set_value(max(a.get_lower(),
+        min(value, a.get_upper() - a.get_page_size())))
+
   def remove_terminal(self, t):
+    self.tracker.remove(t)
+    self.index.remove(t)
+    self.used.pop(t, None)
     self.remove(t)
     if not self.get_n_pages():
       self.create()
+    else:
+      # Share out what it was using.
+      self.rebalance()
 
   def shutdown(self):
+    self.tracker.stop()
+    self.index.stop()
     for child in self.get_children():
       child.term.disconnect(child.exited_handler)
-      child.cwd_discovery.stop()
       if child.pid > 0:
         os.kill(child.pid, 15)
 
@@ -167,7 +402,6 @@ class Terminal(Gtk.HBox):
 
   file_match = GObject.Property(type=int)
   url_match = GObject.Property(type=int)
-  cwd_discovery = GObject.Property(type=CwdDiscovery)
   label = GObject.Property(type=Gtk.Label)
   pid = GObject.Property(type=int)
   cwd = GObject.Property(type=Gio.File)
@@ -180,7 +414,13 @@ class Terminal(Gtk.HBox):
     sw.add(self.term)
     self.pack_start(self._create_toolbar(), False, False, 0)
     self.pack_start(sw, True, True, 0)
+    self.scrollback_limit = -1
     self.term.set_scrollback_lines(-1)
+    self.started = False
+    self.wd = None
+    # Whether the shell tells us its directory itself, with OSC 7.
+    self.osc7 = False
+    self.process = ''
     self._add_matches()
     self.label = self._create_tab_label()
     self.term.connect('button-press-event', self._on_button_press_event)
@@ -197,7 +437,10 @@ class Terminal(Gtk.HBox):
 
   def _markup(self):
     ecwd = GLib.markup_escape_text(self.cwd.get_path())
-    return f'<span size="small">{ecwd} [<span weight="bold">{self.pid}</span>]</span>'
+    if not self.started:
+      return f'<span size="small">{ecwd}</span>'
+    running = GLib.markup_escape_text(self.process or str(self.pid))
+    return f'<span size="small">{ecwd} [<span weight="bold">{running}</span>]</span>'
     
   def _create_toolbar(self):
     t = ui.MiniToolbar.vertical(
@@ -269,16 +512,38 @@ class Terminal(Gtk.HBox):
 
   def _started_callback(self, t, pid, *args):
     self.pid = pid
-    self.cwd_discovery = CwdDiscovery(pid)
-    self.cwd_discovery.connect('cwd-changed', self._on_cwd_changed)
-    self.cwd_discovery.start()
+    self._update_label()
     self.grab_focus()
+    self.get_parent().tracker.poke()
+
+  def set_scrollback_limit(self, lines: int):
+    if lines != self.scrollback_limit:
+      self.scrollback_limit = lines
+      self.term.set_scrollback_lines(lines)
 
-  def _on_cwd_changed(self, w, cwd):
+  def scrollback_used(self) -> int:
+    """Lines of scrollback held, not counting the screen."""
+    a = self.term.get_vadjustment()
+    return max(0, int(a.get_upper() - a.get_lower() - a.get_page_size()))
+
+  def set_cwd(self, cwd: Gio.File):
     self.cwd = cwd
     self._update_label()
 
+  def set_process(self, name: str):
+    self.process = name
+    self._update_label()
+
+  def prepare(self, wd):
+    """Get ready to start in wd, showing it until we do."""
+    self.wd = wd
+    self.cwd = Gio.File.new_for_path(wd)
+    self._update_label()
+
   def start(self, wd):
+    self.wd = wd
+    if not self.cwd:
+      self.cwd = Gio.File.new_for_path(wd)
     self.term.spawn_async(
         Vte.PtyFlags.DEFAULT,
         wd,
@@ -299,18 +564,25 @@ class Terminal(Gtk.HBox):
     # Environ, or fallback to login shell
     return os.environ.get('SHELL', pwd.getpwuid(os.getuid())[-1])
 
-  def _get_selection(self):
+  def _on_button_press_event(self, w, event):
+    # Clicks are resolved asynchronously, after the event is gone.
+    event = event.copy()
     if self.term.get_has_selection():
-      # Get the selection value from the primary buffer
+      # First check the selection, from the primary buffer.
       clipboard = Gtk.Clipboard.get(Gdk.SELECTION_PRIMARY)
-      selection = clipboard.wait_for_text()
-      return selection
+      clipboard.request_text(self._on_selection_received, event)
+      return
+    m, tag = w.match_check_event(event)
+    self._on_match(m, tag, event)
 
-  def _on_button_press_event(self, w, event):
-    # First check the selection
-    m, tag = self._get_selection(), self.file_match
-    if not m:
-      m, tag = w.match_check_event(event)
+  def _on_selection_received(self, clipboard, text, event):
+    if text and text.strip():
+      self._on_match(text, self.file_match, event)
+    else:
+      m, tag = self.term.match_check_event(event)
+      self._on_match(m, tag, event)
+
+  def _on_match(self, m, tag, event):
     if not m:
       return
     m = m.strip()
@@ -328,9 +600,12 @@ class Terminal(Gtk.HBox):
       f = Gio.File.new_for_path(m)
     else:
       f = self.cwd.get_child(m)
-    if not f.query_exists(None):
+    PATHS.query(f, self._on_path_resolved, f, event)
+
+  def _on_path_resolved(self, file_type, f, event):
+    if file_type is None:
       return
-    if f.query_file_type(0, None) == Gio.FileType.DIRECTORY:
+    if file_type == Gio.FileType.DIRECTORY:
       if event.button == Gdk.BUTTON_PRIMARY:
         self.get_parent().emit('directory-activated', f)
       elif event.button == Gdk.BUTTON_SECONDARY:
@@ -367,8 +642,13 @@ class Terminal(Gtk.HBox):
 # https://github.com/luvit/pcre2/blob/master/src/pcre2.h.in
 PCRE2_MULTILINE = 0x00000400
 
+# Only what looks like a path: anything with a slash in it, or a name with an
+# extension. Plain words are not worth checking, or underlining on hover.
 FILE_RE = Vte.Regex.new_for_match(
-  r'(\H+)',
+  (r'(?<![\w./~@+-])'
+   r'(?:(?:~|\.{1,2}|[\w.@+-]+)?(?:/[\w.@+~-]+)+/?'
+   r'|[\w@+-][\w.@+-]*\.[A-Za-z]\w{0,7})'
+   r'(?![\w/@+~-])'),
   -1,
   PCRE2_MULTILINE,
 )
@@ -0,0 +1,335 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Stream the NeoVim grid to remote viewers.
+
+A viewer connects to the b8 service socket and sends the `watch` command. From
+then on the connection is a stream of msgpack frames `[kind, compressed,
+body]`, where body is itself msgpack, zlib compressed if `compressed` is set.
+
+The first frame is a `snapshot` of the whole grid, the highlight table, the
+default colors and the cursor. Every NeoVim flush after that is a `delta`: the
+grid_line, grid_scroll, hl_attr_define, default_colors_set and grid_resize
+events since the previous flush, in NeoVim's own compact encoding, plus the
+cursor. Watch a running b8 with:
+
+    python3 -m b8.viewers
+"""
+
+import sys, zlib
+
+import msgpack
+from gi.repository import Gio, GLib, GObject
+
+from b8 import logs
+
+
+# Events forwarded to viewers, everything else only matters locally.
+PUBLISHED_EVENTS = {
+    'grid_line',
+    'grid_scroll',
+    'grid_resize',
+    'hl_attr_define',
+    'default_colors_set',
+}
+
+# Bodies bigger than this are compressed. Small deltas, like typing, are not
+# worth the zlib overhead.
+COMPRESS_SIZE = 1024
+
+# A viewer with this much unwritten data is too slow to keep up. We drop what
+# is queued and send it a fresh snapshot once it catches up.
+MAX_QUEUED = 1024 * 1024
+
+
+def encode_frame(kind: str, data) -> bytes:
+  body = msgpack.packb(data, use_bin_type=True)
+  compressed = len(body) > COMPRESS_SIZE
+  if compressed:
+    body = zlib.compress(body, 1)
+  return msgpack.packb([kind, compressed, body], use_bin_type=True)
+
+
+def decode_frame(frame):
+  kind, compressed, body = frame
+  if compressed:
+    body = zlib.decompress(body)
+  return kind, msgpack.unpackb(body, raw=False, strict_map_key=False)
+
+
+class Watcher(GObject.GObject, logs.LoggerMixin):
+  """A single connected viewer."""
+
+  __gtype_name__ = 'b8-viewers-watcher'
+
+  __gsignals__ = {
+    'closed': (GObject.SignalFlags.RUN_FIRST, None, ()),
+  }
+
+  conn = GObject.Property(type=Gio.SocketConnection)
+
+  def __init__(self, conn: Gio.SocketConnection, publisher):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.conn = conn
+    self.publisher = publisher
+    self.out = conn.get_output_stream()
+    self.queue = []
+    self.queued = 0
+    self.rest = b''
+    self.writing = None
+    self.needs_snapshot = True
+
+  def send(self, frame: bytes):
+    if self.needs_snapshot:
+      return
+    if self.queued + len(frame) > MAX_QUEUED:
+      self.debug('viewer is too slow, resynchronizing')
+      self.queue = []
+      self.queued = 0
+      self.needs_snapshot = True
+    else:
+      self.queue.append(frame)
+      self.queued += len(frame)
+    self._write()
+
+  def _write(self):
+    if self.writing is not None:
+      return
+    data = self.rest
+    self.rest = b''
+    # Only snapshot between batches. Halfway through one, the grid already has
+    # events that the next delta would send again.
+    if self.needs_snapshot and not self.publisher.events:
+      self.needs_snapshot = False
+      self.queue = [self.publisher.snapshot()]
+    data += b''.join(self.queue)
+    self.queue = []
+    self.queued = 0
+    if not data:
+      return
+    self.writing = data
+    self.out.write_bytes_async(GLib.Bytes.new(data), GLib.PRIORITY_LOW, None,
+        self._on_written)
+
+  def _on_written(self, out, res):
+    try:
+      written = out.write_bytes_finish(res)
+    except GLib.Error as e:
+      self.debug(f'viewer went away: {e.message}')
+      self.close()
+      return
+    self.rest = self.writing[written:]
+    self.writing = None
+    self._write()
+
+  def close(self):
+    self.conn.close(None)
+    self.emit('closed')
+
+
+class Publisher(GObject.GObject, logs.LoggerMixin):
+  """Collects the grid changes of an `Embedded` and sends them to viewers.
+
+  Nothing is collected while nobody is watching.
+  """
+
+  __gtype_name__ = 'b8-viewers-publisher'
+
+  def __init__(self, vim):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.vim = vim
+    self.watchers = []
+    self.events = []
+
+  @property
+  def active(self) -> bool:
+    return bool(self.watchers)
+
+  def add(self, conn: Gio.SocketConnection):
+    w = Watcher(conn, self)
+    w.connect('closed', self._on_watcher_closed)
+    self.watchers.append(w)
+    self.info(f'{len(self.watchers)} viewers watching')
+    w._write()
+
+  def _on_watcher_closed(self, w):
+    self.watchers.remove(w)
+    if not self.watchers:
+      self.events = []
+    self.info(f'{len(self.watchers)} viewers watching')
+
+  def record(self, msg):
+    """Called for every redraw event, only while active."""
+    name = msg[0]
+    if name == 'flush':
+      self.publish()
+    elif name in PUBLISHED_EVENTS:
+      self.events.append(msg)
+
+  def publish(self):
+    frame = self._encode_delta(self.events)
+    for w in list(self.watchers):
+      w.send(frame)
+    self.events = []
+    # Those that joined, or fell behind, during the batch.
+    for w in list(self.watchers):
+      if w.needs_snapshot:
+        w._write()
+
+  def _encode_delta(self, events) -> bytes:
+    c = self.vim.cursor
+    return encode_frame('delta', {
+        'events': events,
+        'cursor': [c.y, c.x],
+    })
+
+  def snapshot(self) -> bytes:
+    """The full state of the grid, for new or resynchronizing viewers."""
+    v = self.vim
+    c = v.cursor
+    dh = v.default_highlight
+    data = {
+        'colors': dh.attrs if dh else None,
+        'hl': [[h.id, h.attrs] for h in v.highlights.values()],
+        'cursor': [c.y, c.x],
+        'size': None,
+        'rows': [],
+    }
+    grid = getattr(v, 'grid', None)
+    if grid:
+      data['size'] = [grid.width, grid.height]
+      data['rows'] = [self._encode_row(row) for row in grid.cells]
+    return encode_frame('snapshot', data)
+
+  def _encode_row(self, row):
+    """A grid row in grid_line's cell encoding, with runs collapsed."""
+    cells = []
+    last_hl = -1
+    last = None
+    for c in row:
+      hl = c.hl.id if c.hl else 0
+      if last is not None and c.text == last[0] and hl == last_hl:
+        if len(last) == 1:
+          last.extend([hl, 2])
+        elif len(last) == 2:
+          last.append(2)
+        else:
+          last[2] += 1
+        continue
+      last = [c.text] if hl == last_hl else [c.text, hl]
+      last_hl = hl
+      cells.append(last)
+    return cells
+
+
+class Viewer:
+  """Reconstructs the screen from published frames, without any UI."""
+
+  def __init__(self):
+    self.unpacker = msgpack.Unpacker(raw=False)
+    self.width = 0
+    self.height = 0
+    self.cells = []
+    self.highlights = {}
+    self.colors = None
+    self.cursor = (0, 0)
+    self.frames = 0
+
+  def feed(self, data: bytes):
+    self.unpacker.feed(data)
+    for frame in self.unpacker:
+      self.apply(*decode_frame(frame))
+
+  def apply(self, kind, data):
+    self.frames += 1
+    if kind == 'snapshot':
+      self.colors = data['colors']
+      self.highlights = dict(data['hl'])
+      if data['size']:
+        self.resize(*data['size'])
+        for row, cells in enumerate(data['rows']):
+          self.put(row, 0, cells)
+    elif kind == 'delta':
+      handlers = {
+          'grid_line': self._on_grid_line,
+          'grid_scroll': self._on_grid_scroll,
+          'grid_resize': self._on_grid_resize,
+          'hl_attr_define': self._on_hl_attr_define,
+          'default_colors_set': self._on_default_colors_set,
+      }
+      for event in data['events']:
+        f = handlers[event[0]]
+        for args in event[1:]:
+          f(*args)
+    self.cursor = tuple(data['cursor'])
+
+  def resize(self, width, height):
+    self.width = width
+    self.height = height
+    self.cells = [[[' ', 0] for col in range(width)] for row in range(height)]
+
+  def put(self, row, col, cells):
+    hl = 0
+    line = self.cells[row]
+    for cell in cells:
+      if len(cell) > 1:
+        hl = cell[1]
+      repeat = cell[2] if len(cell) > 2 else 1
+      for i in range(repeat):
+        line[col] = [cell[0], hl]
+        col += 1
+
+  def scroll(self, top, bottom, left, right, rows):
+    if rows > 0:
+      order = range(top, bottom - rows)
+    else:
+      order = range(bottom - 1, top - rows - 1, -1)
+    for row in order:
+      self.cells[row][left:right] = self.cells[row + rows][left:right]
+
+  def text(self) -> str:
+    return '\n'.join(''.join(c[0] for c in row) for row in self.cells)
+
+  def _on_grid_line(self, gid, row, col, cells, *wrap):
+    self.put(row, col, cells)
+
+  def _on_grid_scroll(self, gid, top, bottom, left, right, rows, cols):
+    self.scroll(top, bottom, left, right, rows)
+
+  def _on_grid_resize(self, gid, width, height):
+    self.resize(width, height)
+
+  def _on_hl_attr_define(self, hl_id, attrs, term_attrs, info):
+    self.highlights[hl_id] = attrs
+
+  def _on_default_colors_set(self, *colors):
+    self.colors = list(colors)
+
+
+def main():
+  from b8 import service
+  run = service.Runtime()
+  for client in run.available():
+    break
+  else:
+    print('no instances to watch')
+    return
+  conn = client.connect(client.address, None)
+  conn.get_output_stream().write_bytes(
+      GLib.Bytes.new(msgpack.packb(['watch', []])))
+  inp = conn.get_input_stream()
+  v = Viewer()
+  while True:
+    d = inp.read_bytes(65536).get_data()
+    if not d:
+      break
+    v.feed(d)
+    sys.stdout.write('\x1b[H\x1b[2J' + v.text())
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  main()
@@ -37,12 +37,21 @@ will be janky at least. In reality it's worse than just jank. We don't have
 enough data to render a widget so we'd have to just show a blank screen.
 """
 
+import json, os, time
 from typing import Iterable, List
 import msgpack
 from gi.repository import Gio, GLib, GObject, Gdk, Gtk, Pango, PangoCairo
 import cairo
 
-from b8 import ui, logs, version
+from b8 import ui, logs, recordings, stats, version, viewers
+
+
+def fnameescape(path: str) -> str:
+  """Escape a file name for an Ex command, like Vim's `fnameescape()`."""
+  path = ''.join('\\' + c if c in FNAME_SPECIAL else c for c in path)
+  if path.startswith(('+', '>', '-')):
+    path = '\\' + path
+  return path
 
 
 class Grid:
@@ -93,6 +102,8 @@ class Mode(GObject.GObject):
 
 class Highlight:
   """Information about a NeoVim highlight."""
+  id = None
+  attrs = None
   foreground = None 
   background = None
   special = None
@@ -152,8 +163,28 @@ class Buffer(GObject.GObject):
     self.name = file.get_basename()
     self.ename = GLib.markup_escape_text(self.name)
     self.eparent = GLib.markup_escape_text(self.parent.get_path())
-    self.markup = (f'<span size="medium" weight="bold">{self.ename}</span>\n'
-                   f'<span size="x-small">{self.parent.get_path()}</span>')
+    self.modified = False
+    self.lines = None
+    self.filetype = ''
+    self._update_markup()
+
+  def set_info(self, modified: bool, lines: int, filetype: str):
+    """Update what we know of the buffer from `buffers-info`."""
+    self.modified = modified
+    self.lines = lines
+    self.filetype = filetype
+    self._update_markup()
+
+  def _update_markup(self):
+    flag = ' ●' if self.modified else ''
+    details = [self.eparent]
+    if self.lines:
+      details.append(f'{self.lines} lines')
+    if self.filetype:
+      details.append(GLib.markup_escape_text(self.filetype))
+    details = ' · '.join(details)
+    self.markup = (f'<span size="medium" weight="bold">{self.ename}{flag}'
+                   f'</span>\n<span size="x-small">{details}</span>')
 
   @classmethod
   def from_ext_hook(cls, ext_data):
@@ -191,6 +222,51 @@ class Drag(GObject.GObject):
   pressed = GObject.Property(type=bool, default=False)
 
 
+class Clipboard(GObject.GObject, logs.LoggerMixin):
+  """NeoVim clipboard provider backed by Gtk.Clipboard.
+
+  NeoVim's default provider forks xclip, xsel or wl-copy on every yank and put
+  to the `+` and `*` registers. Since we already own an RPC channel and a GTK
+  clipboard we can service those in-process instead.
+
+  The last copy to each register is cached, so that putting our own yank keeps
+  its register type (e.g. linewise) without splitting the text again.
+  """
+
+  __gtype_name__ = 'b8-vim-clipboard'
+
+  def __init__(self):
+    GObject.GObject.__init__(self)
+    logs.LoggerMixin.__init__(self)
+    self.cache = {}
+
+  def copy(self, reg: str, lines: List[str], regtype: str):
+    text = '\n'.join(lines)
+    self.cache[reg] = (text, lines, regtype)
+    self._get_clipboard(reg).set_text(text, -1)
+
+  def paste(self, reg: str, callback, data):
+    """Asynchronously fetch a register, calling `callback(value, data)`."""
+    self._get_clipboard(reg).request_text(self._on_text_received,
+        (reg, callback, data))
+
+  def _get_clipboard(self, reg: str) -> Gtk.Clipboard:
+    return Gtk.Clipboard.get(CLIPBOARD_SELECTIONS.get(reg,
+      Gdk.SELECTION_CLIPBOARD))
+
+  def _on_text_received(self, clipboard, text, user_data):
+    reg, callback, data = user_data
+    cached = self.cache.get(reg)
+    if cached and cached[0] == text:
+      callback([cached[1], cached[2]], data)
+      return
+    self.cache.pop(reg, None)
+    if text is None:
+      text = ''
+    # Without a register type NeoVim will guess it from the trailing newline.
+    callback(text.split('\n'), data)
+
+
 class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
 
   __gtype_name__ = 'b8-vim'
@@ -198,8 +274,11 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
   __gsignals__ = {
       'ready': (GObject.SignalFlags.RUN_FIRST, None, ()),
       'exited': (GObject.SignalFlags.RUN_FIRST, None, ()),
+      'leaving': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
       'buffer-changed': (GObject.SignalFlags.RUN_FIRST, None, (int, Gio.File,)),
       'buffer-deleted': (GObject.SignalFlags.RUN_FIRST, None, (int, Gio.File,)),
+      'buffers-added': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
+      'buffers-info': (GObject.SignalFlags.RUN_FIRST, None, (object,)),
       'mode-changed': (GObject.SignalFlags.RUN_FIRST, None, (Mode,)),
       'cursor-changed': (GObject.SignalFlags.RUN_FIRST, None, (Cursor,)),
   }
@@ -211,6 +290,9 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
   mode = GObject.Property(type=Mode)
   proc = GObject.Property(type=Gio.Subprocess)
   source = GObject.Property(type=GLib.Source)
+  clipboard_provider = GObject.Property(type=bool, default=True)
+  record_path = GObject.Property(type=str, default='')
+  latency_report = GObject.Property(type=str, default='')
 
   button_drag = False
   button_pressed = False
@@ -224,7 +306,29 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
     self.mode = None
     self.modes = {}
     self.pending_commands = {}
+    self.buffer_info_pending = set()
+    self.buffer_info_timeout = None
     self.drag = Drag()
+    self.clipboard = Clipboard()
+    self.argv = list(NVIM_ARGV)
+    self.recorder = None
+    self.latency = stats.Latency()
+    self.redraw_stats = stats.Counters()
+    self.flush_sizes = stats.Histogram()
+    self.flush_size = 0
+    self.publisher = viewers.Publisher(self)
+    self.redraw_handlers = {
+        'grid_resize': self._grid_resize_callback,
+        'option_set': self._option_set_callback,
+        'default_colors_set': self._default_colors_set_callback,
+        'hl_attr_define': self._hl_attr_define_callback,
+        'grid_cursor_goto': self._grid_cursor_goto_callback,
+        'mode_info_set': self._mode_info_set_callback,
+        'mode_change': self._mode_change_callback,
+        'grid_line': self._grid_line_callback,
+        'grid_scroll': self._grid_scoll_callback,
+        'flush': self._flush_callback,
+    }
     self.default_highlight = None
     self.button_pressed = None
     self.set_can_focus(True)
@@ -251,8 +355,74 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
     self.debug('quitting')
     self._cmd('nvim_command', ['q!']);
 
-  def open_buffer(self, path):
-    self._cmd('nvim_command', [f'e!{path}']);
+  def open_buffer(self, path, line=None):
+    path = fnameescape(path)
+    if line:
+      self._cmd('nvim_command', [f'e! +{line} {path}']);
+    else:
+      self._cmd('nvim_command', [f'e!{path}']);
+
+  def open_buffers(self, paths: List[str], lines: List[int]=None,
+                   current: int=0):
+    """Open many files at once, editing the one at index current.
+
+    The rest are only added to the buffer list, like `:badd`, so they are not
+    read until they are switched to, when the cursor goes to their line if
+    given. Everything is sent in a single call, and the buffers are announced
+    together with `buffers-added` rather than one BufEnter at a time.
+    """
+    if not paths:
+      return
+    paths = [os.path.abspath(p) for p in paths]
+    lines = lines or [None] * len(paths)
+    calls = []
+    for p, line in zip(paths, lines):
+      at = f'+{line} ' if line else ''
+      calls.append(['nvim_command', [f'badd {at}{fnameescape(p)}']])
+    # bufnr() would take the path as a pattern, bufadd() finds it exactly.
+    calls += [['nvim_call_function', ['bufadd', [p]]] for p in paths]
+    calls.append(['nvim_command', [f'e!{fnameescape(paths[current])}']])
+    r = self._cmd('nvim_call_atomic', [calls])
+    r.connect('success', self._on_open_buffers_success, paths)
+
+  def _on_open_buffers_success(self, r, result, paths):
+    values, error = result
+    if error:
+      self.error(f'unable to open every file: {error}')
+    numbers = values[len(paths):2 * len(paths)]
+    self.emit('buffers-added', [(n, Gio.File.new_for_path(p))
+        for p, n in zip(paths, numbers) if n > 0])
+
+  def request_buffer_info(self, bnum: int):
+    """Fetch a buffer's details soon, along with any others that changed."""
+    self.buffer_info_pending.add(bnum)
+    if self.buffer_info_timeout is None:
+      self.buffer_info_timeout = GLib.timeout_add(BUFFER_INFO_DELAY,
+          self._on_buffer_info_timeout)
+
+  def _on_buffer_info_timeout(self):
+    self.buffer_info_timeout = None
+    numbers = sorted(self.buffer_info_pending)
+    self.buffer_info_pending = set()
+    calls = []
+    for n in numbers:
+      calls.append(['nvim_call_function', ['getbufinfo', [n]]])
+      calls.append(['nvim_call_function', ['getbufvar', [n, '&filetype']]])
+    r = self._cmd('nvim_call_atomic', [calls])
+    r.connect('success', self._on_buffer_info_success, numbers)
+    return False
+
+  def _on_buffer_info_success(self, r, result, numbers):
+    values, error = result
+    info = {}
+    for i, n in enumerate(numbers):
+      if 2 * i + 1 >= len(values) or not values[2 * i]:
+        # Wiped out in the meantime.
+        continue
+      b = values[2 * i][0]
+      info[n] = (bool(b.get('changed')), b.get('linecount'),
+                 values[2 * i + 1])
+    self.emit('buffers-info', info)
 
   def change_buffer(self, bnum):
     self._cmd('nvim_command', [f'b!{bnum}']);
@@ -290,30 +460,53 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
 
   def _out_callback(self, *args):
     if self.vim_out.is_readable():
-      d = self.vim_out.read_bytes(1024)
-      self.unpacker.feed(d.get_data())
-      for msg in self.unpacker:
-        self._msg_callback(msg)
+      d = self.vim_out.read_bytes(READ_SIZE).get_data()
+      if self.recorder:
+        self.recorder.write(d)
+      self.feed(d)
     return True
 
+  def feed(self, data: bytes):
+    """Handle raw msgpack data as if it had been read from NeoVim."""
+    self.unpacker.feed(data)
+    for msg in self.unpacker:
+      self._msg_callback(msg)
+
   def _msg_callback(self, msg):
     msg_handlers = {
+        0: self._request_callback,
         1: self._reply_callback,
         2: self._notification_callback,
     }
     msg_handlers[msg[0]](msg[1:])
 
+  def _request_callback(self, msg):
+    rid, name, args = msg
+    msg_handlers = {
+        'clipboard': self._clipboard_request_callback,
+    }
+    f = msg_handlers.get(name)
+    if f:
+      f(rid, args)
+    else:
+      self._respond(rid, f'unsupported request {name}', None)
+
+  def _respond(self, rid: int, error, result):
+    d = self._serialize_message([1, rid, error, result])
+    self.vim_in.write_all(d, None)
+
   def _reply_callback(self, msg):
-    rid, err, result = msg
+    rid, err, value = msg
     result = self.pending_commands.pop(rid)
-    result.respond(rid, err, result)
-    self.debug(f'reply {msg}')
+    result.respond(rid, err, value)
+    self.debug(f'reply {rid} {result.name}')
 
   def _notification_callback(self, msg):
     msg_handlers = {
         'buffers': self._buffers_callback,
         'system': self._system_callback,
         'redraw': self._redraw_callback,
+        'clipboard': self._clipboard_callback,
     }
     msg_handlers[msg[0]](msg[1])
 
@@ -327,6 +520,8 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
     msg_handlers = {
         'enter': self._buffers_enter_callback,
         'delete': self._buffers_delete_callback,
+        'modified': self._buffers_info_callback,
+        'written': self._buffers_info_callback,
     }
     f = msg_handlers.get(action)
     if f:
@@ -336,26 +531,62 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
 
   def _buffers_enter_callback(self, bnum, f):
     self.emit('buffer-changed', bnum, f)
+    self.request_buffer_info(bnum)
+
+  def _buffers_info_callback(self, bnum, f):
+    self.request_buffer_info(bnum)
   
   def _buffers_delete_callback(self, bnum, f):
     self.emit('buffer-deleted', bnum, f)
   
+  def _clipboard_callback(self, msg):
+    action, reg, lines, regtype = msg
+    if action == 'copy':
+      self.clipboard.copy(reg, lines, regtype)
+    else:
+      self.debug(f'clipboard event unhandled: {action}')
+
+  def _clipboard_request_callback(self, rid, args):
+    action, reg = args
+    if action == 'paste':
+      self.clipboard.paste(reg, self._on_clipboard_paste, rid)
+    else:
+      self._respond(rid, f'unsupported clipboard action {action}', None)
+
+  def _on_clipboard_paste(self, value, rid):
+    self._respond(rid, None, value)
+
   def _system_callback(self, msg):
     action = msg[0]
     msg_handlers = {
+        'leaving': self._system_leaving_callback,
         'leave': self._system_leave_callback,
         'enter': self._system_enter_callback,
     }
     f = msg_handlers.get(action)
     if f:
-      f()
+      f(*msg[1:])
     else:
       self.debug(f'system event unhandled: {msg}')
 
+  def _system_leaving_callback(self, info):
+    """Called for a Vim VimLeavePre notification, see VIM_SESSION_EXPR."""
+    self.emit('leaving', info)
+
   def _system_leave_callback(self):
     """Called for a Vim VimLeave notification."""
+    if self.recorder:
+      self.recorder.close()
+      self.recorder = None
+    if self.latency_report:
+      self._write_latency_report()
     self.emit('exited')
 
+  def _write_latency_report(self):
+    self.info(f'writing latency report to {self.latency_report}')
+    with open(self.latency_report, 'w') as f:
+      json.dump(self.latency.summary(), f, indent=2)
+
   def _system_enter_callback(self):
     self.debug('VimEnter autocmd')
     if not self.options.get('guifont'):
@@ -367,24 +598,22 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
 
   def _redraw_callback(self, msgs):
     """Called for a Vim redraw notification."""
-    msg_handlers = {
-        'grid_resize': self._grid_resize_callback,
-        'option_set': self._option_set_callback,
-        'default_colors_set': self._default_colors_set_callback,
-        'hl_attr_define': self._hl_attr_define_callback,
-        'grid_cursor_goto': self._grid_cursor_goto_callback,
-        'mode_info_set': self._mode_info_set_callback,
-        'mode_change': self._mode_change_callback,
-        'grid_line': self._grid_line_callback,
-        'grid_scroll': self._grid_scoll_callback,
-        'flush': self._flush_callback,
-    }
+    msg_handlers = self.redraw_handlers
+    counters = self.redraw_stats
+    publisher = self.publisher if self.publisher.active else None
     for msg in msgs:
-      f = msg_handlers.get(msg[0])
+      if publisher:
+        publisher.record(msg)
+      name = msg[0]
+      n = len(msg) - 1
+      self.flush_size += n
+      f = msg_handlers.get(name)
       if f:
+        started = time.perf_counter()
         f(*msg[1:])
+        counters.add(name, n, time.perf_counter() - started)
       else:
-        self.debug(f'redraw unhandled {msg[0]}, {len(msg)}')
+        counters.add(f'unhandled.{name}', n)
 
   def _grid_resize_callback(self, msg):
     gid, cols, rows = msg
@@ -397,6 +626,7 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
   def _default_colors_set_callback(self, hl):
     fg, bg, special, tfg, tbg = hl
     c = self.default_highlight = Highlight()
+    c.attrs = hl
     c.foreground = Color(fg)
     c.background = Color(bg)
     c.special = Color(special)
@@ -404,6 +634,8 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
   def _hl_attr_define_callback(self, *args):
     for hl_id, cs, tcs, empty in args:
       c = self.highlights[hl_id] = Highlight()
+      c.id = hl_id
+      c.attrs = cs
       for k in cs:
         v = cs[k]
         if isinstance(v, int):
@@ -429,6 +661,7 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
     self.cursor = Cursor(cols, rows)
 
   def _grid_line_callback(self, *args):
+    written = 0
     for arg in args:
       row = arg[1]
       colstart = arg[2]
@@ -448,9 +681,12 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
           c.text = text
           c.hl = self.highlights.get(hl)
           colstart += 1
+      written += colstart - arg[2]
+    self.redraw_stats.add('grid_line.cells', written)
 
   def _grid_scoll_callback(self, msg):
     gid, top, bottom, left, right, rows, cols = msg
+    self.redraw_stats.add('grid_scroll.rows', bottom - top - abs(rows))
     if rows > 0:
       row = top
       while row <= bottom - rows:
@@ -475,10 +711,16 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
         row -= 1
 
   def _flush_callback(self, *args):
+    self.flush_sizes.add(self.flush_size)
+    self.flush_size = 0
+    self.latency.flush()
     self.queue_draw()
 
   def _start(self):
-    self.proc = Gio.Subprocess.new(['nvim', '--embed'],
+    if self.record_path:
+      self.info(f'recording NeoVim to {self.record_path}')
+      self.recorder = recordings.Recorder(self.record_path)
+    self.proc = Gio.Subprocess.new(self.argv,
         Gio.SubprocessFlags.STDOUT_PIPE | Gio.SubprocessFlags.STDERR_PIPE |
         Gio.SubprocessFlags.STDIN_PIPE)
     self.vim_in = self.proc.get_stdin_pipe()
@@ -490,6 +732,8 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
     self._vim_attach()
     self._vim_subscribe()
     self._set_client_info()
+    if self.clipboard_provider:
+      self._vim_clipboard()
 
   def _calculate_font_size(self):
     self.font_name = self.options['guifont']
@@ -508,9 +752,13 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
     self._vim_resize()
 
   def _on_realize(self, w):
-    self.pango_layout = PangoCairo.create_layout(w.get_window().cairo_create())
-    self.pango_layout.set_alignment(Pango.Alignment.LEFT)
-    self.pango_layout.set_font_description(self.font_desc)
+    self.pango_layout = self._create_layout(w.get_window().cairo_create())
+
+  def _create_layout(self, cr):
+    layout = PangoCairo.create_layout(cr)
+    layout.set_alignment(Pango.Alignment.LEFT)
+    layout.set_font_description(self.font_desc)
+    return layout
 
   def _on_key_press_event(self, widget, event, *args):
     key_name = Gdk.keyval_name(event.keyval)
@@ -540,6 +788,7 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
 
     if input_str == '\x00':
       self.error(f'empty string {key_name}')
+    self.latency.input()
     self._vim_input(input_str)
     return True
 
@@ -618,7 +867,15 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
     return f'<{"-".join(out)}>'
 
   def _on_draw(self, w, cr):
+    started = time.perf_counter()
     w.get_window().freeze_updates()
+    self.draw(cr)
+    w.get_window().thaw_updates()
+    self.latency.paint()
+    self.redraw_stats.add('paint', 1, time.perf_counter() - started)
+
+  def draw(self, cr):
+    """Paint the grid onto any cairo context, e.g. an offscreen surface."""
     bg = self.default_highlight.background
     cr.set_source_rgb(bg.r, bg.g, bg.b)
     cr.paint()
@@ -679,8 +936,6 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
           PangoCairo.show_layout(cr, self.pango_layout)
           _, r = self.pango_layout.get_pixel_extents()
 
-    w.get_window().thaw_updates()
-
 
   def _vim_attach(self):
     self._cmd('nvim_ui_attach', [self.width, self.height, {'ext_linegrid':
@@ -695,6 +950,17 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
       self._cmd('nvim_subscribe', [t]);
 
 
+  def _vim_clipboard(self):
+    r = self._cmd('nvim_get_api_info', [])
+    r.connect('success', self._on_vim_clipboard_api_info)
+
+  def _on_vim_clipboard_api_info(self, r, info):
+    chan, metadata = info
+    self._cmd('nvim_command', [VIM_CLIPBOARD_TEMPLATE.format(chan=chan)])
+    # The provider may already have been loaded by the user's config.
+    for cmd in VIM_CLIPBOARD_RELOAD:
+      self._cmd('nvim_command', [cmd])
+
   def _vim_resize(self):
     self._cmd('nvim_ui_try_resize', [self.width, self.height])
 
@@ -705,17 +971,67 @@ class Embedded(Gtk.DrawingArea, logs.LoggerMixin):
     self._cmd('nvim_input_mouse', [button, action, modifier, 0, row, col])
 
 
+# What a session needs: the current buffer, and the name and cursor line of
+# every listed buffer, without the rest of getbufinfo() like their variables.
+VIM_SESSION_EXPR = (
+    "{'current': bufnr('%'), 'buffers': map(getbufinfo({'buflisted': 1}), "
+    "{_, b -> {'bufnr': b.bufnr, 'name': b.name, 'lnum': b.lnum}})}"
+)
+
 VIM_SIGNAL_TEMPLATE = 'autocmd {} * call rpcnotify(0, "{}", "{}", {})'
 
 VIM_SIGNALS = [
     ('BufAdd', 'buffers', 'add', 'expand("<abuf>"), expand("<amatch>")'),
     ('BufEnter', 'buffers', 'enter', 'expand("<abuf>"), expand("<amatch>")'),
     ('BufDelete', 'buffers', 'delete', 'expand("<abuf>"), expand("<amatch>")'),
+    ('BufModifiedSet', 'buffers', 'modified',
+     'expand("<abuf>"), expand("<amatch>")'),
+    ('BufWritePost', 'buffers', 'written',
+     'expand("<abuf>"), expand("<amatch>")'),
+    ('FileType', 'buffers', 'modified', 'expand("<abuf>"), expand("<afile>")'),
+    # However NeoVim is quit, for saving the session.
+    ('VimLeavePre', 'system', 'leaving', VIM_SESSION_EXPR),
     ('VimLeave', 'system', 'leave', ''),
     ('VimEnter', 'system', 'enter', ''),
 ]
 
 
+# Override `Embedded.argv` to run something else, e.g. a recordings.FakeNvim.
+NVIM_ARGV = ['nvim', '--embed']
+
+# Registers NeoVim as a clipboard client of ours. Copies are notifications as
+# NeoVim does not need to wait for them, pastes are requests we reply to.
+VIM_CLIPBOARD_TEMPLATE = (
+    "let g:clipboard = {{'name': 'b8', "
+    "'copy': {{"
+    "'+': {{l, t -> rpcnotify({chan}, 'clipboard', 'copy', '+', l, t)}}, "
+    "'*': {{l, t -> rpcnotify({chan}, 'clipboard', 'copy', '*', l, t)}}}}, "
+    "'paste': {{"
+    "'+': {{-> rpcrequest({chan}, 'clipboard', 'paste', '+')}}, "
+    "'*': {{-> rpcrequest({chan}, 'clipboard', 'paste', '*')}}}}, "
+    "'cache_enabled': 0}}"
+)
+
+VIM_CLIPBOARD_RELOAD = [
+    'unlet! g:loaded_clipboard_provider',
+    'runtime autoload/provider/clipboard.vim',
+]
+
+CLIPBOARD_SELECTIONS = {
+    '+': Gdk.SELECTION_CLIPBOARD,
+    '*': Gdk.SELECTION_PRIMARY,
+}
+
+# Buffer events are collected for this many milliseconds, and the details of
+# every buffer they were for fetched in one request.
+BUFFER_INFO_DELAY = 100
+
+# Characters with a meaning in Ex file names, as escaped by `fnameescape()`.
+FNAME_SPECIAL = set(' \t\n*?[{`$\\%#\'"|!<')
+
+# Large enough that a multi-megabyte register does not take thousands of trips
+# around the main loop.
+READ_SIZE = 65536
 
 MODIFIER_NAMES = {
     'Shift_L',
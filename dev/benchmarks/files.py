@@ -0,0 +1,294 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Benchmarks for the file browser.
+
+Synthetic directories are generated in a temporary directory: flat ones of
+various sizes, a deep tree, and Git repositories with many modified and
+untracked files. Each is browsed by a fresh `Files` widget that is never shown,
+running the main loop until it settles. GTK widgets need a display, so run it
+under Xvfb on a headless machine. Results are printed as JSON, for comparing
+across commits:
+
+    PYTHONPATH=. xvfb-run python3 dev/benchmarks/files.py > before.json
+    PYTHONPATH=. python3 dev/benchmarks/files.py --scenarios flat --sizes 1000
+"""
+
+import gi
+gi.require_version('Gtk', '3.0')
+
+import argparse, json, os, platform, shutil, subprocess, tempfile, time
+import tracemalloc
+
+from gi.repository import GLib, Gtk
+
+from b8 import files, version
+
+
+SIZES = [1000, 10000, 100000]
+
+EXTENSIONS = ['.py', '.txt', '.c', '.h', '.md', '.json', '.png', '']
+
+# Depth and directories per level of the deep tree, with FANOUT files in each.
+DEPTH = 6
+FANOUT = 4
+
+# Fractions of a repository's files that are modified and untracked.
+MODIFIED = 0.1
+UNTRACKED = 0.1
+
+# Give up on anything that takes longer than this many seconds.
+TIMEOUT = 300
+
+
+def make_flat(root, size):
+  """A directory of size entries, one in twenty of them directories."""
+  for i in range(size):
+    name = os.path.join(root, f'entry{i}{EXTENSIONS[i % len(EXTENSIONS)]}')
+    if i % 20 == 0:
+      os.mkdir(name)
+    else:
+      open(name, 'w').close()
+
+
+def make_deep(root, depth, fanout):
+  """A tree depth levels deep, with fanout files and directories in each."""
+  count = 0
+  level = [root]
+  for d in range(depth):
+    below = []
+    for parent in level:
+      for i in range(fanout):
+        open(os.path.join(parent, f'file{i}.py'), 'w').close()
+        child = os.path.join(parent, f'dir{i}')
+        os.mkdir(child)
+        below.append(child)
+        count += 2
+    level = below
+  return count
+
+
+def git(root, *args):
+  subprocess.run(['git', '-C', root] + list(args), check=True,
+      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_repository(root, size):
+  """A committed repository with some files modified and some untracked."""
+  git(root, 'init', '-q')
+  names = []
+  for i in range(size):
+    # Spread over subdirectories, so directory statuses are aggregated too.
+    d = os.path.join(root, f'pkg{i % 50}')
+    os.makedirs(d, exist_ok=True)
+    name = os.path.join(d, f'module{i}.py')
+    with open(name, 'w') as f:
+      f.write(f'x = {i}\n')
+    names.append(name)
+  git(root, 'add', '-A')
+  git(root, '-c', 'user.name=b8', '-c', 'user.email=b8@localhost',
+      'commit', '-q', '-m', 'Synthetic')
+  modified = int(size * MODIFIED)
+  for name in names[:modified]:
+    with open(name, 'a') as f:
+      f.write('y = 1\n')
+  untracked = int(size * UNTRACKED)
+  for i in range(untracked):
+    open(os.path.join(root, f'pkg{i % 50}', f'new{i}.py'), 'w').close()
+  return {'modified': modified, 'untracked': untracked}
+
+
+def wait(condition, timeout=TIMEOUT, waiting_for=None):
+  """Run the main loop until condition is true, or raise after timeout."""
+  ctx = GLib.MainContext.default()
+  deadline = time.perf_counter() + timeout
+  while not condition():
+    if time.perf_counter() > deadline:
+      what = f': {waiting_for()}' if waiting_for else ''
+      raise TimeoutError(f'gave up waiting for the file browser{what}')
+    ctx.iteration(True)
+
+
+def settle():
+  """Run whatever is pending, so one measurement does not leak into the next."""
+  ctx = GLib.MainContext.default()
+  while ctx.pending():
+    ctx.iteration(False)
+
+
+def bench_browse(path, tree_mode=False):
+  """Time a fresh browser showing path, then measure another's memory.
+
+  Tracing allocations slows Python down a lot, so the memory is measured in a
+  second pass rather than while timing.
+  """
+  r = browse(path, tree_mode)
+  traced = browse(path, tree_mode, trace=True)
+  r['peak_python_kb'] = traced['peak_python_kb']
+  r['retained_python_kb'] = traced['retained_python_kb']
+  return r
+
+
+def browse(path, tree_mode=False, trace=False):
+  """Show path in a fresh browser, timing it until loaded and decorated."""
+  settle()
+  w = files.Files()
+  w.tree_mode = tree_mode
+  model = w.tree_store if tree_mode else w.model
+  times = {}
+
+  def on_row_inserted(model, path, giter):
+    times.setdefault('first_row', time.perf_counter())
+
+  model.connect('row-inserted', on_row_inserted)
+  if trace:
+    tracemalloc.start()
+  started = time.perf_counter()
+  w.browse_path(path)
+  listing = w.listing
+  repository = w.repository
+  if repository:
+    repository.connect('changed',
+        lambda r: times.setdefault('status', time.perf_counter()))
+  wait(lambda: listing.loaded)
+  # Let the last batch and the sort that follows it run.
+  settle()
+  times['complete'] = time.perf_counter()
+  if repository:
+    wait(lambda: 'status' in times)
+  r = {
+      'rows': model.iter_n_children(None),
+      'first_row_ms': (times['first_row'] - started) * 1000,
+      'complete_ms': (times['complete'] - started) * 1000,
+  }
+  if repository:
+    r['status_ms'] = (times['status'] - started) * 1000
+    r['decorated_rows'] = sum(1 for row in model if row[2])
+  if trace:
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    r['peak_python_kb'] = peak // 1024
+    r['retained_python_kb'] = current // 1024
+  w.destroy()
+  return r
+
+
+def bench_expand(path):
+  """Time expanding the whole of a tree, one level at a time."""
+  settle()
+  w = files.Files()
+  w.tree_mode = True
+  w.browse_path(path)
+  started = time.perf_counter()
+  levels = 0
+  def loading():
+    return [p for p, n in w.nodes.items() if not n.listing.loaded]
+
+  while True:
+    # Expanding loads the level below, which is expanded next time round.
+    wait(lambda: not loading(),
+        waiting_for=lambda: f'{len(loading())} directories still loading, '
+                            f'like {loading()[:3]}')
+    settle()
+    count = len(w.nodes)
+    w.tree.expand_all()
+    levels += 1
+    if len(w.nodes) == count:
+      break
+  taken = time.perf_counter() - started
+  r = {
+      'directories': len(w.nodes),
+      'levels': levels,
+      'expand_all_ms': taken * 1000,
+      # Far more than the listings cache holds, as every one is pinned.
+      'listings_kept': len(w.listings.listings),
+  }
+  w.destroy()
+  return r
+
+
+def scenario_flat(tmp, size):
+  root = os.path.join(tmp, f'flat{size}')
+  os.mkdir(root)
+  make_flat(root, size)
+  return {'entries': size, **bench_browse(root)}
+
+
+def scenario_deep(tmp, size):
+  root = os.path.join(tmp, 'deep')
+  os.mkdir(root)
+  entries = make_deep(root, DEPTH, FANOUT)
+  r = {'entries': entries, 'depth': DEPTH}
+  r.update(bench_browse(root, tree_mode=True))
+  r.update(bench_expand(root))
+  return r
+
+
+def scenario_git(tmp, size):
+  root = os.path.join(tmp, f'git{size}')
+  os.mkdir(root)
+  r = {'entries': size, **make_repository(root, size)}
+  r.update(bench_browse(os.path.join(root, 'pkg0')))
+  return r
+
+
+SCENARIOS = {
+    'flat': scenario_flat,
+    'deep': scenario_deep,
+    'git': scenario_git,
+}
+
+
+def git_revision():
+  try:
+    out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+        capture_output=True, check=True)
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return out.stdout.decode('utf-8').strip()
+
+
+def main():
+  p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  p.add_argument('--sizes', nargs='+', type=int, default=SIZES,
+      help='entries per directory or repository')
+  p.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+      default=sorted(SCENARIOS))
+  p.add_argument('--tmp', help='make the synthetic trees in here')
+  p.add_argument('--output', help='write the JSON here instead of stdout')
+  ns = p.parse_args()
+
+  if not Gtk.init_check(None)[0]:
+    p.error('no display, try running under xvfb-run')
+  if 'git' in ns.scenarios and not shutil.which('git'):
+    p.error('the git scenario needs git')
+
+  results = []
+  with tempfile.TemporaryDirectory(prefix='b8-bench-', dir=ns.tmp) as tmp:
+    for name in ns.scenarios:
+      # The deep tree is the same size whatever is asked for.
+      sizes = ns.sizes[:1] if name == 'deep' else ns.sizes
+      for size in sizes:
+        r = {'scenario': name}
+        r.update(SCENARIOS[name](tmp, size))
+        results.append(r)
+
+  report = {
+      'benchmark': 'files',
+      'version': version.VERSION,
+      'revision': git_revision(),
+      'python': platform.python_version(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'results': results,
+  }
+  s = json.dumps(report, indent=2)
+  if ns.output:
+    with open(ns.output, 'w') as f:
+      f.write(s + '\n')
+  else:
+    print(s)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,239 @@
+# (c) 2005-2020 Ali Afshar <aafshar@gmail.com>.
+# MIT License. See LICENSE.
+# vim: ft=python sw=2 ts=2 sts=2 tw=80
+
+"""Benchmarks for the NeoVim grid and renderer.
+
+Synthetic `redraw` batches are fed straight into `Embedded._redraw_callback`
+and the grid is painted onto an offscreen cairo surface, so no display or
+NeoVim is needed. Results are printed as JSON, for comparing across commits:
+
+    PYTHONPATH=. python3 dev/benchmarks/grid.py > before.json
+    PYTHONPATH=. python3 dev/benchmarks/grid.py --sizes 80x24 --draws 5
+"""
+
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('PangoCairo', '1.0')
+
+import argparse, json, platform, random, subprocess, time
+
+import cairo
+
+from b8 import vim, version
+
+
+SIZES = [(80, 24), (160, 48), (250, 80), (400, 120)]
+
+WORDS = ['def', 'class', 'return', 'self', 'import', 'for', 'in', 'if', 'else',
+         '(', ')', ':', '=', '+', 'x', 'value', '#', 'None', '[]', '{}']
+
+WIDE = ['日', '本', '語', '漢', '字', '한', '국', '😀']
+
+HIGHLIGHTS = 30
+
+
+def text_cells(cols, rnd, hl=None):
+  """A line of source-looking text as grid_line cells with repeats."""
+  cells = []
+  used = 0
+  while used < cols:
+    word = rnd.choice(WORDS)[:cols - used]
+    first = [word[0], hl if hl is not None else rnd.randrange(HIGHLIGHTS)]
+    cells.append(first)
+    cells.extend([c] for c in word[1:])
+    used += len(word)
+    if used < cols:
+      spaces = min(rnd.randrange(1, 4), cols - used)
+      cells.append([' ', 0, spaces])
+      used += spaces
+  return cells
+
+
+def highlight_cells(cols, rnd):
+  """Every cell with its own highlight, so nothing can be run-length coded."""
+  return [[rnd.choice(WORDS)[0], i % HIGHLIGHTS] for i in range(cols)]
+
+
+def wide_cells(cols, rnd):
+  """Double width characters, each followed by NeoVim's empty filler cell."""
+  cells = []
+  for i in range(cols // 2):
+    cells.append([rnd.choice(WIDE), i % HIGHLIGHTS])
+    cells.append([''])
+  if cols % 2:
+    cells.append([' '])
+  return cells
+
+
+def setup_events(cols, rows):
+  hls = [[i, {'foreground': (i * 0x050403) & 0xffffff,
+              'background': (i * 0x010203) & 0xffffff,
+              'bold': i % 3 == 0, 'reverse': i % 7 == 0}, {}, []]
+         for i in range(1, HIGHLIGHTS)]
+  return [
+      ['option_set', ['guifont', 'Monospace 13']],
+      ['default_colors_set', [0x839496, 0x2e2e2e, 0xff0000, 0, 0]],
+      ['hl_attr_define'] + hls,
+      ['mode_info_set', [True, [{'name': 'normal', 'cursor_shape': 'block',
+                                 'cell_percentage': 0}]]],
+      ['mode_change', ['normal', 0]],
+      ['grid_resize', [1, cols, rows]],
+      ['grid_cursor_goto', [1, 0, 0]],
+      ['flush', []],
+  ]
+
+
+def full_repaint(cols, rows, rnd):
+  lines = [[1, row, 0, text_cells(cols, rnd)] for row in range(rows)]
+  return [['grid_line'] + lines, ['grid_cursor_goto', [1, rows - 1, 0]],
+          ['flush', []]]
+
+
+def scroll(cols, rows, rnd):
+  # A window above a status line and the command line, scrolling one line.
+  bottom = rows - 2
+  return [
+      ['grid_scroll', [1, 0, bottom, 0, cols, 1, 0]],
+      ['grid_line', [1, bottom - 1, 0, text_cells(cols, rnd)]],
+      ['grid_cursor_goto', [1, bottom - 1, 0]],
+      ['flush', []],
+  ]
+
+
+def highlight_heavy(cols, rows, rnd):
+  lines = [[1, row, 0, highlight_cells(cols, rnd)] for row in range(rows)]
+  return [['grid_line'] + lines, ['flush', []]]
+
+
+def wide_chars(cols, rows, rnd):
+  lines = [[1, row, 0, wide_cells(cols, rnd)] for row in range(rows)]
+  return [['grid_line'] + lines, ['flush', []]]
+
+
+SCENARIOS = {
+    'full_repaint': full_repaint,
+    'scroll': scroll,
+    'highlight_heavy': highlight_heavy,
+    'wide_chars': wide_chars,
+}
+
+
+def count(batch):
+  """The number of events and the number of grid_line cells in a batch."""
+  events = cells = 0
+  for event in batch:
+    events += len(event) - 1
+    if event[0] == 'grid_line':
+      for line in event[1:]:
+        for cell in line[3]:
+          cells += cell[2] if len(cell) > 2 else 1
+  return events, cells
+
+
+def create_vim(cols, rows):
+  v = vim.Embedded()
+  v.width, v.height = cols, rows
+  v._redraw_callback(setup_events(cols, rows))
+  v._calculate_font_size()
+  return v
+
+
+def bench_redraw(v, batches):
+  events = cells = 0
+  for batch in batches:
+    e, c = count(batch)
+    events += e
+    cells += c
+  started = time.perf_counter()
+  for batch in batches:
+    v._redraw_callback(batch)
+  taken = time.perf_counter() - started
+  return {
+      'batches': len(batches),
+      'events': events,
+      'cells': cells,
+      'redraw_seconds': taken,
+      'events_per_second': events / taken if taken else None,
+      'us_per_cell': taken * 1e6 / cells if cells else None,
+  }
+
+
+def bench_draw(v, cols, rows, iterations):
+  sfc = cairo.ImageSurface(cairo.FORMAT_RGB24, cols * v.cell_width,
+      rows * v.cell_height)
+  cr = cairo.Context(sfc)
+  v.pango_layout = v._create_layout(cr)
+  times = []
+  for i in range(iterations):
+    started = time.perf_counter()
+    v.draw(cr)
+    sfc.flush()
+    times.append(time.perf_counter() - started)
+  times.sort()
+  return {
+      'draws': iterations,
+      'draw_ms_min': times[0] * 1000,
+      'draw_ms_median': times[len(times) // 2] * 1000,
+  }
+
+
+def git_revision():
+  try:
+    out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+        capture_output=True, check=True)
+  except (OSError, subprocess.CalledProcessError):
+    return None
+  return out.stdout.decode('utf-8').strip()
+
+
+def parse_size(s):
+  cols, rows = s.lower().split('x')
+  return int(cols), int(rows)
+
+
+def main():
+  p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  p.add_argument('--sizes', nargs='+', type=parse_size, default=SIZES,
+      help='grid sizes as COLSxROWS')
+  p.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+      default=sorted(SCENARIOS))
+  p.add_argument('--batches', type=int, default=200,
+      help='redraw batches per scenario')
+  p.add_argument('--draws', type=int, default=10,
+      help='offscreen paints per scenario, 0 to skip')
+  p.add_argument('--seed', type=int, default=8)
+  p.add_argument('--output', help='write the JSON here instead of stdout')
+  ns = p.parse_args()
+
+  results = []
+  for name in ns.scenarios:
+    for cols, rows in ns.sizes:
+      rnd = random.Random(ns.seed)
+      batches = [SCENARIOS[name](cols, rows, rnd) for i in range(ns.batches)]
+      v = create_vim(cols, rows)
+      r = {'scenario': name, 'cols': cols, 'rows': rows}
+      r.update(bench_redraw(v, batches))
+      r['counters'] = v.redraw_stats.summary()
+      if ns.draws:
+        r.update(bench_draw(v, cols, rows, ns.draws))
+      results.append(r)
+
+  report = {
+      'benchmark': 'grid',
+      'version': version.VERSION,
+      'revision': git_revision(),
+      'python': platform.python_version(),
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'results': results,
+  }
+  s = json.dumps(report, indent=2)
+  if ns.output:
+    with open(ns.output, 'w') as f:
+      f.write(s + '\n')
+  else:
+    print(s)
+
+
+if __name__ == '__main__':
+  main()